@@ -0,0 +1,204 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# ================================
+# 設定（環境変数で上書き可能）
+# ================================
+# クライアントIPごとのトークンバケット：1秒あたりの補充量と最大保持数
+RATE_LIMIT_PER_SEC = float(os.environ.get("ANAN_RATE_LIMIT_PER_SEC", "0.5"))
+RATE_LIMIT_BURST = float(os.environ.get("ANAN_RATE_LIMIT_BURST", "10"))
+# 指定するとバケットをSQLiteに保存し、複数プロセス間で共有する
+RATE_LIMIT_DB = os.environ.get("ANAN_RATE_LIMIT_DB")
+
+# LLM呼び出しの同時実行数と待ち行列の上限
+LLM_MAX_CONCURRENCY = int(os.environ.get("ANAN_LLM_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.environ.get("ANAN_LLM_MAX_QUEUE", "16"))
+LLM_QUEUE_TIMEOUT = float(os.environ.get("ANAN_LLM_QUEUE_TIMEOUT", "60"))
+
+
+class QueueFullError(Exception):
+    """待ち行列が上限に達しているため即座に拒否した"""
+
+
+class QueueTimeoutError(Exception):
+    """待ち行列で順番が回ってくる前にタイムアウトした"""
+
+
+# ================================
+# トークンバケット（プロセス内共有）
+# ================================
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (残りトークン, 最終更新時刻)
+        self._lock = threading.Lock()
+
+    def allow(self, key: str, cost: float = 1.0):
+        """
+        トークンを1つ消費できれば (True, 0.0)、できなければ (False, 再試行までの秒数) を返す
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                self._buckets[key] = (tokens - cost, now)
+                allowed, retry_after = True, 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                allowed, retry_after = False, (cost - tokens) / self.rate
+            if len(self._buckets) > self.max_keys:
+                self._evict(now)
+        return allowed, retry_after
+
+    def _evict(self, now: float):
+        # 満タンまで回復しているバケットは保持する意味がないので捨てる
+        full_after = self.burst / self.rate
+        stale = [k for k, (_, last) in self._buckets.items() if now - last >= full_after]
+        for k in stale:
+            del self._buckets[k]
+
+
+# ================================
+# トークンバケット（SQLiteでプロセス間共有）
+# ================================
+class SQLiteTokenBucketLimiter:
+    def __init__(self, path: str, rate: float, burst: float):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        conn.close()
+
+    def _connect(self):
+        # isolation_level=None にして BEGIN IMMEDIATE を自前で発行する
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def allow(self, key: str, cost: float = 1.0):
+        # プロセス間で比較するため壁時計を使う
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            tokens, last = row if row else (self.burst, now)
+            tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (cost - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            # DBが使えないときは利用者を止めない
+            allowed, retry_after = True, 0.0
+        finally:
+            conn.close()
+        return allowed, retry_after
+
+
+# ================================
+# LLM同時実行数の制限（順番待ち付き）
+# ================================
+class LLMGate:
+    def __init__(self, max_concurrency: int, max_queue: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiting = deque()  # 到着順のチケット
+        self._cond = threading.Condition()
+
+    def stats(self):
+        with self._cond:
+            return {"active": self._active, "waiting": len(self._waiting)}
+
+    def _acquire(self, timeout, on_wait):
+        ticket = object()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        last_pos = None
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                return
+            if len(self._waiting) >= self.max_queue:
+                raise QueueFullError()
+            self._waiting.append(ticket)
+
+        try:
+            while True:
+                with self._cond:
+                    if self._active < self.max_concurrency and self._waiting[0] is ticket:
+                        self._waiting.popleft()
+                        self._active += 1
+                        self._cond.notify_all()
+                        return
+                    pos = self._waiting.index(ticket) + 1
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise QueueTimeoutError()
+                    else:
+                        remaining = 0.5
+                    if pos == last_pos:
+                        self._cond.wait(min(0.5, remaining))
+                        continue
+                # UI更新はロックの外で行う
+                last_pos = pos
+                if on_wait:
+                    on_wait(pos)
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+            raise
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout: float | None = LLM_QUEUE_TIMEOUT, on_wait=None):
+        """
+        LLM呼び出し枠を1つ確保する。
+        待たされる場合は on_wait(順番) が順番の変化ごとに呼ばれる。
+        待ち行列が満杯なら QueueFullError、timeout 秒を超えたら QueueTimeoutError。
+        """
+        self._acquire(timeout, on_wait)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+# ================================
+# プロセス全体で共有するインスタンス
+# ================================
+if RATE_LIMIT_DB:
+    rate_limiter = SQLiteTokenBucketLimiter(RATE_LIMIT_DB, RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST)
+else:
+    rate_limiter = TokenBucketLimiter(RATE_LIMIT_PER_SEC, RATE_LIMIT_BURST)
+
+llm_gate = LLMGate(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE)
@@ -1,11 +1,28 @@
+import argparse
+import csv
+import html
 import json
 import re
-import numpy as np
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import torch
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from fetch_class_changes import fetch_class_changes
-from openai import OpenAI
+import requests
+from fetch_class_changes import NOT_FOUND_MESSAGE
+from class_change_poller import (
+    POLL_INTERVAL,
+    poll_once,
+    get_current_changes,
+    get_changes_since,
+    start_of_yesterday,
+    format_change_events,
+)
+from corpora import CORPUS_REGISTRY, INTENT_SEPARATOR, TIMETABLE_FILE, TIMETABLE_KEYWORDS, ingest_corpora
+from llm_pool import CircuitBreaker, CircuitOpenError, LLMPool
+from prompts import build_messages
+from routing import ROUTE_TABLE, LARGE_MODEL_NAME, select_route, record_route_usage
+import time
 import os
 
 BASE_DIR = os.path.dirname(__file__)  # anan_ai.py のディレクトリ
@@ -14,16 +31,27 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 # 提供されたコードを基に設定します。
 API_BASE_URL = "http://hpc04.anan-nct.ac.jp:8000/v1"
 API_KEY = "EMPTY" # APIキーが不要な場合
-
-# クライアントをグローバルに初期化
-client = OpenAI(
-    base_url=API_BASE_URL,
-    api_key=API_KEY
+# カンマ区切りで複数指定すると、処理中リクエストが少ないものから順に振り分ける
+API_BASE_URLS = [u.strip() for u in os.environ.get("ANAN_LLM_BASE_URLS", API_BASE_URL).split(",") if u.strip()]
+# 指定秒数以内に最初のトークンが返らなければ別のエンドポイントにも投げる（0で無効）
+LLM_HEDGE_AFTER_SEC = float(os.environ.get("ANAN_LLM_HEDGE_AFTER_SEC", "0"))
+# 連続でこの回数失敗したらLLMを呼ばずに簡易回答を返し、指定秒数後に1件だけ試して復帰を確認する
+LLM_BREAKER_FAILURES = int(os.environ.get("ANAN_LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_RESET_SEC = float(os.environ.get("ANAN_LLM_BREAKER_RESET_SEC", "30"))
+
+# エンドポイントのプールをグローバルに初期化
+llm_pool = LLMPool(
+    API_BASE_URLS,
+    api_key=API_KEY,
+    hedge_after=LLM_HEDGE_AFTER_SEC or None
 )
+llm_pool.start_health_checks()
+llm_breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SEC)
 
 # 使用するモデル名 (サーバー側で提供されているものに合わせる)
-OPENAI_MODEL_NAME = "openai/gpt-oss-120b"
-print(f"--- INFO: LLMモデルを {API_BASE_URL} の {OPENAI_MODEL_NAME} に設定しました。---")
+# 意図ごとのモデル・max_tokens・temperature は routing.py の ROUTE_TABLE で切り替える
+OPENAI_MODEL_NAME = LARGE_MODEL_NAME
+print(f"--- INFO: LLMモデルを {', '.join(API_BASE_URLS)} の {OPENAI_MODEL_NAME} に設定しました。---")
 
 # Embeddingモデルの準備はそのまま維持します (RAG用)
 embedding_model_name = "intfloat/multilingual-e5-large"
@@ -31,90 +59,76 @@ print(f"--- INFO: Embeddingモデル {embedding_model_name} をロード中... -
 embed_model = SentenceTransformer(embedding_model_name)
 print("--- INFO: Embeddingモデルのロード完了 ---")
 
-# ==== ファイル読み込み関数 (拡張) ====
-def load_rules_from_file(filename: str) -> str:
-    filepath = os.path.join(DATA_DIR, filename)
-    try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            rules_content = f.read()
-        print(f"--- INFO: ファイル '{filepath}' を読み込みました。---")
-        return rules_content
-    except FileNotFoundError:
-        print(f"警告: ファイル '{filepath}' が見つかりません。DBは無効化されます。")
-        return ""
-
-
 # ==== JSONを読み込む ====
 # 実際の実行環境に合わせてファイルパスを調整してください
-with open(os.path.join(DATA_DIR, "timetable1.json"), "r", encoding="utf-8") as f:
+with open(os.path.join(DATA_DIR, TIMETABLE_FILE), "r", encoding="utf-8") as f:
     timetable_data = json.load(f)
 
-# ==== JSONをテキスト化（RAG的前処理）====
-def flatten_timetable(data):
-    # (既存の関数。時間割データをフラットなテキストにする)
-    text_data = []
-    for year, grades in data.items():
-        for grade, classes in grades.items():
-            for class_name, days in classes.items():
-                for day, periods in days.items():
-                    for period in periods:
-                        line = f"{year}年度 {grade}{class_name} {day}{period['時限']}限: {period['科目']}（{period['教員']}）@{period['教室']}"
-                        text_data.append(line)
-    return "\n".join(text_data)
-
-knowledge_text = flatten_timetable(timetable_data)
-
-# ==== RAG用 ベクトルDB初期化関数 (変更なし) ====
-def initialize_vector_db(text: str):
-    """校則テキストをチャンク化し、ベクトル化して、DB（リスト）を作成する"""
-    if not text:
-        return None
+# ==== RAG用 ベクトルDB初期化関数 ====
+def load_rule_dbs(names=None):
+    """登録済みの全コーパスをまとめて取り込み、{コーパス名: インデックス} を返す"""
+    return ingest_corpora(lambda chunks: embed_model.encode(chunks, show_progress_bar=False), names)
 
-    # チャンク化：ここでは「空行」で区切って条文単位に分割
-    chunks = [t.strip() for t in text.split('\n\n') if t.strip()]
-    if not chunks:
-        print("警告: テキストから有効なチャンクが抽出できませんでした。")
-        return None
 
-    # ベクトル化
-    embeddings = embed_model.encode(chunks, show_progress_bar=False)
-
-    # DBの構造： [(条文テキスト, ベクトル numpy array), ...] のリストとして格納
-    vector_db = list(zip(chunks, embeddings))
-
-    print(f"--- INFO: ベクトルDBの初期化完了。チャンク数: {len(chunks)} ---")
-    return vector_db
-
-
-# ==== RAG用 コンテキスト取得関数 (変更なし) ====
-def get_rule_context_from_rag(query: str, rule_vector_db: list, k: int = 5):
+# ==== RAG用 コンテキスト取得関数 ====
+def get_rule_context_from_rag(query: str, rule_vector_db, k: int = 5, query_vector=None):
     """
     質問をベクトル化し、ルールDBから最も関連性の高い条文を検索して返す
+    query_vector を渡した場合はベクトル化を省略する（バッチ処理でまとめて計算したとき）
     """
     if not rule_vector_db:
         return None, f"ユーザーの質問「{query}」に対する回答を生成できませんでした。"
 
     # 1. 質問をベクトル化
-    query_vector = embed_model.encode(query)
+    if query_vector is None:
+        query_vector = embed_model.encode(query)
 
-    # 2. 検索用のデータ準備
-    chunks = [item[0] for item in rule_vector_db]
-    vectors = np.array([item[1] for item in rule_vector_db])
+    # 2. コサイン類似度の高い順に Top k 個の条文を検索
+    results = rule_vector_db.search(query_vector, k)
 
-    # 3. 類似度計算 (コサイン類似度を使用)
-    # query_vectorを (1, embed_dim) の形に整形して計算
-    similarities = cosine_similarity(query_vector.reshape(1, -1), vectors)
+    return format_rule_context(query, results)
 
-    # 4. Top k個のインデックスを取得 (類似度が高い順)
-    top_k_indices = np.argsort(similarities[0])[-k:][::-1]
 
-    # 5. 関連条文（チャンク)を結合してコンテキストとする
-    context = "\n---\n".join([chunks[i] for i in top_k_indices])
+def format_rule_context(query: str, results):
+    """検索結果 [(条文, 類似度), ...] を結合してコンテキストとする"""
+    context = "\n---\n".join(chunk for chunk, _ in results)
 
     question_text = f"ユーザーの質問「{query}」に対する回答を、以下の【校則データ】に基づいて生成してください。"
 
     return context, question_text
 
+
+# ==== 複数の意図に当てはまる質問 ====
+# 両方の最上位の類似度の差がこれ以下なら、両方の条文を合わせてLLMに渡す
+AMBIGUITY_MERGE_MARGIN = float(os.environ.get("ANAN_AMBIGUITY_MERGE_MARGIN", "0.02"))
+
+def resolve_ambiguous_intent(query: str, candidates, rule_dbs, query_vector=None, k: int = 5):
+    """
+    複数のコーパスのキーワードに当てはまる質問について、上位2つのDBを検索し、
+    検索の確からしさ（最上位の類似度）が高い方を選ぶ。僅差なら両方の条文を類似度順に合わせる。
+    戻り値: (回答に使う意図のリスト（先頭が最も確からしいもの）, 検索結果 [(条文, 類似度), ...])。
+    候補のDBが1つ以下なら検索結果は None
+    """
+    available = [c for c in candidates if rule_dbs.get(c)][:2]
+    if len(available) < 2:
+        return [available[0] if available else candidates[0]], None
+
+    # 質問のベクトル化は1回だけ。検索は各コーパスの vector_index（ANAN_VECTOR_INDEX の方式）で行い、
+    # 対象は多くても2コーパスなので、コーパスが大きくなっても通常の質問の検索2回分で収まる
+    if query_vector is None:
+        query_vector = embed_model.encode(query)
+    results = {c: rule_dbs[c].search(query_vector, k) for c in available}
+
+    def top_score(intent):
+        return results[intent][0][1] if results[intent] else float("-inf")
+
+    # 同点なら登録順（キーワード判定の優先順）を優先する
+    winner, runner_up = sorted(available, key=top_score, reverse=True)
+    if top_score(winner) - top_score(runner_up) <= AMBIGUITY_MERGE_MARGIN:
+        merged = sorted(results[winner] + results[runner_up], key=lambda r: r[1], reverse=True)[:k]
+        return [winner, runner_up], merged
+    return [winner], results[winner]
+
 # ==== 表記ゆれ正規化関数 (変更なし) ====
 def normalize(text: str) -> str:
     # 漢数字、全角数字、スペースなどを半角・統一形式に変換
@@ -175,120 +189,83 @@ def get_relevant_text(data, year="2025", grade="1年", class_name="2組", day="
                 lines.append(line)
     return "\n".join(lines) if lines else None
 
-# ==== 質問の意図判定関数 (変更なし) ====
-def determine_intent(query: str):
+# ==== 質問の意図判定関数 ====
+def determine_intent_candidates(query: str):
     """
-    質問が時間割、身だしなみ、成績表、特別欠席のいずれに関するものかを判定する
+    キーワードが当てはまる意図をすべて優先順に返す（時間割 → corpora.py の CORPUS_REGISTRY の登録順）
     """
     query_n = normalize(query)
+    candidates = []
 
     # 1. 時間割のキーワード
-    if any(k in query_n for k in ["時間割", "何組", "何限", "教室", "授業", "今日", "限"]):
-        return "timetable"
-
-    # 2. 身だしなみのキーワード (style.txt)
-    if any(k in query_n for k in ["身だしなみ", "髪", "服装", "制服", "略装", "靴", "アクセサリー"]):
-        return "grooming"
-
-    # 3. 成績表のキーワード (grade.txt)
-    if any(k in query_n for k in ["成績", "成績表", "単位", "点数", "GPA", "評価", "赤点", "原点", "何点"]):
-        return "grades"
-
-    # 4. 特別欠席のキーワード (absent.txt)
-    if any(k in query_n for k in ["欠席", "欠課", "ストライキ", "交通機関", "汽車", "病気", "インフル", "特別"]):
-        return "abstract"
+    if any(k in query_n for k in TIMETABLE_KEYWORDS):
+        candidates.append("timetable")
 
-    # 5. 自転車に関するキーワード
-    if any(k in query_n for k in ["自転車", "駐輪場", "バイク", "通学", "原付", "二輪車"]):
-        return "cycle"
+    # 2. 登録順にコーパスのキーワードを照合
+    for name, corpus in CORPUS_REGISTRY.items():
+        if any(k in query_n for k in corpus["keywords"]):
+            candidates.append(name)
 
-    # 6. 留学に関するキーワード
-    if any(k in query_n for k in ["留学", "海外", "研修", "台湾", "ニュージーランド", "インターンシップ"]):
-        return "abroad"
+    return candidates
 
-    # 7. 進路に関するキーワード (sinro.txt)
-    if any(k in query_n for k in ["進路", "就職", "進学", "大学", "専攻科", "推薦", "求人", "企業","編入"]):
-        return "sinro"
 
-    # 8. アルバイト/課外活動に関するキーワード (part.txt)
-    if any(k in query_n for k in ["アルバイト", "バイト"]):
-        return "part"
-
-    # 9. その他に関するキーワード (other.txt)
-    if any(k in query_n for k in ["校則", "規則", "携帯電話", "スマホ", "スマートフォン", "いじめ", "始業時間", "授業時間", "コース配属", "保護者面談", "高専", "5年一貫"]):
-        return "other"
-
-    # 10. 奨学金/学費に関するキーワード (money.txt)
-    if any(k in query_n for k in ["奨学金", "学費", "授業料", "免除", "お金", "費用", "振込"]):
-        return "money"
+def determine_intent(query: str):
+    """
+    質問が時間割か、登録済みのどのコーパスに関するものかを判定する（最優先の1つ）
+    「門限」の「限」など、時間割のキーワードに偶然当たっただけ（クラス指定なし）なら規則の方を返す
+    """
+    candidates = determine_intent_candidates(query)
+    if not candidates:
+        return "general"
+    if candidates[0] == "timetable" and len(candidates) >= 2 and not detect_class_from_query(query):
+        return candidates[1]
+    return candidates[0]
+
+# ==== LLMが使えないときの簡易回答 ====
+DEGRADED_ANSWER_LABEL = "【簡易回答】AIモデルに接続できないため、関連する資料の該当箇所をそのまま表示しています。"
+DEGRADED_MAX_CHUNKS = 3
+
+def build_degraded_answer(prompt_type: str, context: str) -> str:
+    """LLMを使わず、検索した条文や時間割の行をそのまま見せる"""
+    if prompt_type == "rules":
+        body = "\n\n".join(context.split("\n---\n")[:DEGRADED_MAX_CHUNKS])
+    else:
+        body = context
+    return f"{DEGRADED_ANSWER_LABEL}\n\n{body}"
 
-    # 11. 寮生活に関するキーワード (domitory.txt)
-    if any(k in query_n for k in ["寮", "寮生活", "阿南寮", "門限", "外泊", "帰省", "部屋"]):
-        return "domitory"
 
-    # 12. 部活動に関するキーワード (clab.txt)
-    if any(k in query_n for k in ["部活", "部活動", "クラブ", "サークル", "大会", "兼部"]):
-        return "clab"
+# ==== LLMに質問（OpenAI API版） ====
+# rule_dbs は {コーパス名: インデックス}（load_rule_dbs() の戻り値）
+def ask_question(query, timetable_data, rule_dbs, query_vector=None, llm_slot=None):
+    return answer_question(query, timetable_data, rule_dbs, query_vector, llm_slot)[1]
 
-    return "general"
 
-# ==== LLMに質問（OpenAI API版） ====
-# 呼び出し側の引数に合わせて、全てのDB変数を引数として受け取るように修正
-def ask_question(query, timetable_data, grooming_db, grades_db, abstract_db, cycle_db, abroad_db, sinro_db, part_db, other_db, money_db, domitory_db, clab_db):
+def answer_question(query, timetable_data, rule_dbs, query_vector=None, llm_slot=None):
+    """
+    ask_question と同じ処理で、(実際に回答に使った意図, 回答) を返す。
+    複数のコーパスに当てはまる質問は検索結果で意図が変わるため、回答キャッシュやバッチの集計はこちらを使う
+    llm_slot を渡すと、LLMの呼び出しの間だけ llm_slot() のコンテキストに入る（app.py の同時実行枠）。
+    検索や時間割の処理はその外で行うので、LLMを呼ばない質問は順番待ちをしない
+    """
 
     # 意図判定
     intent = determine_intent(query)
+    answered_intent = intent
+    rule_candidates = [c for c in determine_intent_candidates(query) if c in CORPUS_REGISTRY]
 
     context = None
     question_text = ""
     prompt_type = ""
-    db = None
-    db_name = None # RAGで使うデータベース名を格納するための変数
-
-    # 1. RAG対象データベースの割り当てと名前の設定
-    if intent == "grooming":
-        db = grooming_db
-        db_name = "身だしなみ校則"
-    elif intent == "grades":
-        db = grades_db
-        db_name = "成績表ルール"
-    elif intent == "abstract":
-        db = abstract_db
-        db_name = "特別欠席ルール"
-    elif intent == "cycle":
-        db = cycle_db
-        db_name = "自転車規則"
-    elif intent == "abroad":
-        db = abroad_db
-        db_name = "留学・海外研修"
-    elif intent == "sinro":
-        db = sinro_db
-        db_name = "進路"
-    elif intent == "part":
-        db = part_db
-        db_name = "アルバイト・課外活動"
-    elif intent == "other":
-        db = other_db
-        db_name = "その他規則"
-    elif intent == "money":
-        db = money_db
-        db_name = "奨学金・学費"
-    elif intent == "domitory":
-        db = domitory_db
-        db_name = "寮生活"
-    elif intent == "clab":
-        db = clab_db
-        db_name = "部活動"
-    # timetableまたはgeneralの場合は db は None のまま
-
-    # 2. 意図に応じたデータの取得 (時間割 または RAG)
+    period = None
+
+    # 意図に応じたデータの取得 (時間割 または RAG)
     if intent == "timetable":
         class_info = detect_class_from_query(query)
         day = detect_day_from_query(query)
         period = detect_period_from_query(query)
 
         if not class_info:
-            return "クラスを特定できませんでした。例: 1年2組、1-2、二組 など"
+            return answered_intent, "クラスを特定できませんでした。例: 1年2組、1-2、二組 など"
 
         grade, class_name = class_info
         day = day or "月曜"
@@ -296,7 +273,7 @@ def ask_question(query, timetable_data, grooming_db, grades_db, abstract_db, cyc
         context = get_relevant_text(timetable_data, year="2025", grade=grade, class_name=class_name, day=day, period=period)
 
         if not context:
-            return f"{grade}{class_name}の{day}の時間割が見つかりませんでした。"
+            return answered_intent, f"{grade}{class_name}の{day}の時間割が見つかりませんでした。"
 
         if period:
             question_text = f"{grade}{class_name}の{day}{period}限の授業は何ですか?"
@@ -305,91 +282,73 @@ def ask_question(query, timetable_data, grooming_db, grades_db, abstract_db, cyc
 
         prompt_type = "timetable"
 
-    elif db is not None:
+    elif intent in CORPUS_REGISTRY:
+        # 複数のコーパスに当てはまるときは、両方を検索して確からしい方だけをLLMに渡す
+        results = None
+        if len(rule_candidates) >= 2:
+            intents, results = resolve_ambiguous_intent(query, rule_candidates, rule_dbs, query_vector)
+            # 条文を合わせた場合は、回答キャッシュが両方の元データの更新で無効になるよう両方の意図を返す
+            intent, answered_intent = intents[0], INTENT_SEPARATOR.join(intents)
+
         # RAGを使用するDBの処理を共通化
+        db = rule_dbs.get(intent)
+        db_name = CORPUS_REGISTRY[intent]["display_name"]
         if not db:
-            return f"{db_name}に関する情報が現在利用できません。しばらくしてからもう一度試してください。"
+            return answered_intent, f"{db_name}に関する情報が現在利用できません。しばらくしてからもう一度試してください。"
 
-        context, question_text = get_rule_context_from_rag(query, db)
+        if results is not None:
+            context, question_text = format_rule_context(query, results)
+        else:
+            context, question_text = get_rule_context_from_rag(query, db, query_vector=query_vector)
 
         if not context:
             # RAG検索しても関連情報が見つからなかった場合
-            return f"{db_name}に関する情報がデータに見つかりませんでした。"
+            return answered_intent, f"{db_name}に関する情報がデータに見つかりませんでした。"
 
         prompt_type = "rules"
 
     else:
         # 質問の意図のリストを更新
-        return "すみません、質問の内容が少し曖昧でした。もう少し詳しく教えてもらえると助かります。"
+        return answered_intent, "すみません、質問の内容が少し曖昧でした。もう少し詳しく教えてもらえると助かります。"
 
 
-    # == プロンプトテンプレートの切り替え ==
-    if prompt_type == "timetable":
-        # 時間割用：フレンドリーで簡潔な回答を促すプロンプト
-        prompt = f"""あなたは阿南高専の学生サポートAIです。
-以下の時間割データを使って、自然な口調で答えてください。
-
-【時間割データ】
-{context}
-
-【質問】
-{question_text}
-
-【回答の指示】
-- すべての授業情報（時限、科目名、先生、教室）を含めて答える
-- 簡潔に2〜3文程度でまとめる
-- 情報を省略せず、でも読みやすくまとめる
-- 必要な情報のみ回答する
-【回答】
-"""
-        max_tokens = 1200
-    elif prompt_type == "rules":
-        # 校則用：丁寧だけど親しみやすい回答を促すプロンプト
-        prompt = f"""あなたは阿南高専の学生サポートAIです。
-以下の参照データを使って、自然な口調で答えてください。
-
-【参照データ】
-{context}
-
-【質問】
-{question_text}
-
-【回答の指示】
-- 難しい言葉遣いは避け、わかりやすく説明する
-- 必要な情報は正確に伝えつつ、会話的に答える
-- 表形式（テーブル、|記号）は使わず、文章で答える
-- データにない情報は「それについては情報がありません」と答える
-- **回答は必要な情報をすべて含め、途中で終わらせずに完結させる** # ← 新たに追加
-
-【回答】
-"""
-        max_tokens = 1200
-    else:
-        # ここには到達しないはずだが、念のため
-        return "内部エラー: プロンプトタイプが不明です。"
+    # == プロンプトの組み立て ==
+    # 固定の指示は system、参照データと質問は user に分けてプレフィックスキャッシュを効かせる
+    messages = build_messages(prompt_type, context, question_text)
 
     # === LLM実行 ===
-    # clientはグローバル変数として定義されていることを想定
-    # OPENAI_MODEL_NAMEはグローバル変数として定義されていることを想定
-    try:
-        resp = client.chat.completions.create(
-            model=OPENAI_MODEL_NAME,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=max_tokens,
-            temperature=0.7  # 少し高めにして自然な口調を促す
-        )
-        response_text = resp.choices[0].message.content
-
-    except Exception as e:
-        # エラー発生時の処理（メインループで囲まれたとき、この print は表示されない可能性あり）
-        # print(f"エラー: OpenAI API呼び出し中にエラーが発生しました: {e}")
-        return "AIモデルへの問い合わせ中にエラーが発生しました。"
+    # llm_poolはグローバル変数として定義されていることを想定
+    # 意図と質問の複雑さに応じてモデル・出力上限・温度を切り替える
+    route = select_route(intent, query, period)
+    params = ROUTE_TABLE[route]
+    # 回路が開いている間はLLMを呼ばずに簡易回答を返すだけなので、順番待ちの枠を使わない
+    slot = llm_slot() if llm_slot and llm_breaker.state != llm_breaker.OPEN else nullcontext()
+    with slot:
+        start = time.perf_counter()
+        try:
+            response_text, usage = llm_breaker.call(
+                llm_pool.chat,
+                model=params["model"],
+                messages=messages,
+                max_tokens=params["max_tokens"],
+                temperature=params["temperature"]
+            )
+
+        except CircuitOpenError:
+            # LLMが復帰するまでは待たずに参照データから簡易回答を返す
+            return answered_intent, build_degraded_answer(prompt_type, context)
+
+        except Exception as e:
+            record_route_usage(route, intent, params["model"], time.perf_counter() - start, ok=False)
+            # エラー発生時の処理（メインループで囲まれたとき、この print は表示されない可能性あり）
+            # print(f"エラー: OpenAI API呼び出し中にエラーが発生しました: {e}")
+            return answered_intent, "AIモデルへの問い合わせ中にエラーが発生しました。\n\n" + build_degraded_answer(prompt_type, context)
+
+    record_route_usage(route, intent, params["model"], time.perf_counter() - start, usage)
 
     # === 回答の後処理 ===
     if response_text is None:
-        return "AIモデルが回答を生成できませんでした。"
+        return answered_intent, "AIモデルが回答を生成できませんでした。"
 
     # プロンプトより後だけ切り抜く
     answer = response_text.split("【回答】")[-1].strip()
@@ -422,83 +381,108 @@ def ask_question(query, timetable_data, grooming_db, grades_db, abstract_db, cyc
     # 最終的な空行削除と整形
     answer = '\n'.join([line.strip() for line in answer.split('\n') if line.strip()])
 
-    return answer
+    return answered_intent, answer
+
+
+# ==== バッチ質問モード ====
+def load_batch_questions(source: str):
+    """
+    JSONL（1行1件、文字列または {"question": ...}）、CSV（question 列または先頭列）、
+    "history" の場合は履歴DBから質問を読み込む
+    """
+    if source == "history":
+        conn = sqlite3.connect(os.environ.get("ANAN_HISTORY_DB", "history.db"))
+        rows = conn.execute("SELECT DISTINCT question FROM history ORDER BY id").fetchall()
+        conn.close()
+        # 履歴にはエスケープ済みの文字列が入っている
+        return [html.unescape(r[0]) for r in rows if r[0]]
+
+    questions = []
+    with open(source, "r", encoding="utf-8", newline="") as f:
+        if source.endswith(".csv"):
+            reader = csv.reader(f)
+            header = next(reader, None)
+            col = header.index("question") if header and "question" in header else 0
+            if header and "question" not in header:
+                questions.append(header[col])
+            questions.extend(row[col] for row in reader if row)
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                questions.append(item["question"] if isinstance(item, dict) else str(item))
+    return [q.strip() for q in questions if q.strip()]
+
+
+def run_batch(questions, timetable_data, rule_dbs, concurrency: int = 4):
+    """複数の質問をまとめて処理し、質問ごとの意図・回答・処理時間のリストを返す"""
+    candidates = [determine_intent_candidates(q) for q in questions]
+
+    # RAGを使う質問の埋め込みは1回の encode でまとめて計算する
+    rag_indices = [i for i, c in enumerate(candidates) if any(intent in rule_dbs for intent in c)]
+    query_vectors = [None] * len(questions)
+    embed_start = time.perf_counter()
+    if rag_indices:
+        vectors = embed_model.encode([questions[i] for i in rag_indices], show_progress_bar=False)
+        for i, v in zip(rag_indices, vectors):
+            query_vectors[i] = v
+    embed_sec = time.perf_counter() - embed_start
+    print(f"--- INFO: {len(rag_indices)} 件の質問を {embed_sec:.2f} 秒でベクトル化しました ---")
+
+    def answer_one(i):
+        start = time.perf_counter()
+        try:
+            intent, answer = answer_question(questions[i], timetable_data, rule_dbs, query_vector=query_vectors[i])
+            error = None
+        except Exception as e:
+            intent, answer, error = determine_intent(questions[i]), None, str(e)
+        return {
+            "question": questions[i],
+            "intent": intent,
+            "answer": answer,
+            "error": error,
+            "elapsed_sec": round(time.perf_counter() - start, 3),
+        }
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(answer_one, range(len(questions))))
+
+
+def write_batch_results(path: str, results):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=["question", "intent", "answer", "error", "elapsed_sec"])
+            writer.writeheader()
+            writer.writerows(results)
+        else:
+            for r in results:
+                f.write(json.dumps(r, ensure_ascii=False) + "\n")
 
 
 # ==== メインループ (変更なし) ====
 if __name__ == "__main__":
-
-    # -----------------------------------------------------------
-    # RAGデータベースの初期化（全3ファイル対応）
-    GROOMING_RULES_FILE = os.path.join(DATA_DIR, "style.txt") # 身だしなみ
-    GRADES_RULES_FILE = os.path.join(DATA_DIR, "grade.txt")   # 成績表
-    ABSTRACT_RULES_FILE = os.path.join(DATA_DIR, "abstract.txt")  # 特別欠席
-    CYCLE_RULES_FILE = os.path.join(DATA_DIR, "cycle.txt")   #自転車
-    ABROAD_RULES_FILE = os.path.join(DATA_DIR, "abroad.txt") # 留学・海外研修
-    SINRO_RULES_FILE = os.path.join(DATA_DIR, "sinro.txt")   # 進路
-    PART_RULES_FILE = os.path.join(DATA_DIR, "part.txt")     # アルバイト/課外活動
-    OTHER_RULES_FILE = os.path.join(DATA_DIR, "other.txt")   # その他
-    MONEY_RULES_FILE = os.path.join(DATA_DIR, "money.txt")   # 奨学金/学費
-    DOMITORY_RULES_FILE = os.path.join(DATA_DIR, "domitory.txt") # 寮生活
-    CLAB_RULES_FILE = os.path.join(DATA_DIR, "clab.txt")     # 部活動
-
-    # 1. 身だしなみDBの作成
-    grooming_text = load_rules_from_file(GROOMING_RULES_FILE)
-    grooming_db = initialize_vector_db(grooming_text)
-
-    # 2. 成績表DBの作成
-    grades_text = load_rules_from_file(GRADES_RULES_FILE)
-    grades_db = initialize_vector_db(grades_text)
-
-    # 3. 特別欠席DBの作成
-    abstract_text = load_rules_from_file(ABSTRACT_RULES_FILE)
-    abstract_db = initialize_vector_db(abstract_text)
-
-    # 4. 自転車規則DBの作成
-    cycle_text = load_rules_from_file(CYCLE_RULES_FILE)
-    cycle_db = initialize_vector_db(cycle_text)
-
-    # 5. 留学・海外研修DBの作成
-    abroad_text = load_rules_from_file(ABROAD_RULES_FILE)
-    abroad_db = initialize_vector_db(abroad_text)
-
-    # 6. 進路DBの作成
-    sinro_text = load_rules_from_file(SINRO_RULES_FILE)
-    sinro_db = initialize_vector_db(sinro_text)
-
-    # 7. アルバイト/課外活動DBの作成
-    part_text = load_rules_from_file(PART_RULES_FILE)
-    part_db = initialize_vector_db(part_text)
-
-    # 8. その他規則DBの作成
-    other_text = load_rules_from_file(OTHER_RULES_FILE)
-    other_db = initialize_vector_db(other_text)
-
-    # 9. 奨学金・学費DBの作成
-    money_text = load_rules_from_file(MONEY_RULES_FILE)
-    money_db = initialize_vector_db(money_text)
-
-    # 10. 寮生活DBの作成
-    domitory_text = load_rules_from_file(DOMITORY_RULES_FILE)
-    domitory_db = initialize_vector_db(domitory_text)
-
-    # 11. 部活動DBの作成
-    clab_text = load_rules_from_file(CLAB_RULES_FILE)
-    clab_db = initialize_vector_db(clab_text)
-    # -----------------------------------------------------------
-    rule_dbs = {
-        "grooming": grooming_db,
-        "grades": grades_db,
-        "abstract": abstract_db,
-        "cycle": cycle_db,
-        "abroad": abroad_db,
-        "sinro": sinro_db,
-        "part": part_db,
-        "other": other_db,
-        "money": money_db,
-        "domitory": domitory_db,
-        "clab": clab_db,
-    }
+    parser = argparse.ArgumentParser(description="阿南高専Chatbot")
+    parser.add_argument("--batch", metavar="INPUT",
+                        help="質問ファイル（.jsonl / .csv）または history を指定するとバッチ処理する")
+    parser.add_argument("--output", default="batch_results.jsonl", help="バッチ処理の出力先（.jsonl / .csv）")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLMへの同時問い合わせ数")
+    args = parser.parse_args()
+
+    # RAGデータベースの初期化（corpora.py に登録された全コーパス）
+    rule_dbs = load_rule_dbs()
+
+    if args.batch:
+        questions = load_batch_questions(args.batch)
+        print(f"--- INFO: {len(questions)} 件の質問を同時実行数 {args.concurrency} で処理します ---")
+        batch_start = time.perf_counter()
+        results = run_batch(questions, timetable_data, rule_dbs, args.concurrency)
+        write_batch_results(args.output, results)
+        elapsed = [r["elapsed_sec"] for r in results]
+        print(f"--- INFO: {len(results)} 件を {time.perf_counter() - batch_start:.1f} 秒で処理し、{args.output} に保存しました ---")
+        if elapsed:
+            print(f"--- INFO: 1件あたり 平均 {sum(elapsed) / len(elapsed):.2f} 秒 / 最大 {max(elapsed):.2f} 秒 ---")
+        raise SystemExit(0)
 
     print("\n阿南高専Chatbot (時間割/身だしなみ/成績/欠席対応)")
     print("例: 1年2組の火曜日は？ | 髪の校則は？ | 赤点の基準は？ | 交通機関が止まったら？")
@@ -514,24 +498,39 @@ if __name__ == "__main__":
             if "授業変更" in q or "変更" in q:
                 print("\n--- 授業変更を取得しています ---")
                 class_info = detect_class_from_query(q)
+                target_class = None
                 if class_info:
                     grade, class_name = class_info
                     if grade == "1年":
                         target_class = f"1-{class_name[0]}"
                     else:
                         target_class = f"{grade[0]}{class_name}"
-
                     print(f"→ {target_class} の授業変更を検索します")
-                    changes = fetch_class_changes(target_class)
-                    print(changes)
                 else:
                     print("→ クラスが特定できなかったため、全体を取得します")
-                    changes = fetch_class_changes()
-                    print(changes)
+
+                # ローカルの記録が古ければ取得し直してから回答する
+                changes, fetched_at = get_current_changes(target_class)
+                unreachable = False
+                if fetched_at is None or time.time() - fetched_at.timestamp() > POLL_INTERVAL:
+                    try:
+                        if poll_once() is not None:
+                            changes, fetched_at = get_current_changes(target_class)
+                    except requests.RequestException as e:
+                        # 学校サイトに接続できなければ、保存済みの記録から回答する
+                        print(f"警告: 授業変更のページに接続できませんでした: {e}")
+                        unreachable = True
+                if changes is None:
+                    changes = "授業変更のページに接続できず、保存済みの記録もありません。" if unreachable else NOT_FOUND_MESSAGE
+                elif "昨日" in q:
+                    changes = format_change_events(get_changes_since(start_of_yesterday(), target_class), target_class)
+                if fetched_at:
+                    print(f"（最終取得: {fetched_at.strftime('%Y/%m/%d %H:%M')}）")
+                print(changes)
                 continue
 
             # --- 通常の質問（時間割・校則） ---
-            response = ask_question(q, timetable_data, grooming_db, grades_db, abstract_db, cycle_db, abroad_db, sinro_db, part_db, other_db, money_db, domitory_db, clab_db)
+            response = ask_question(q, timetable_data, rule_dbs)
             print("\n--- 回答 ---")
             print(response)
             print()
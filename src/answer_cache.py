@@ -0,0 +1,129 @@
+import glob
+import os
+import re
+import sqlite3
+import unicodedata
+from datetime import datetime
+
+from corpora import CORPUS_REGISTRY, INTENT_SEPARATOR, TIMETABLE_FILE
+
+BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+# app.py の履歴DBと同じファイルに保存する
+ANSWER_CACHE_DB = os.environ.get("ANAN_ANSWER_CACHE_DB", "history.db")
+
+# 意図ごとの回答の元データ（DATA_DIR からの相対パス、glob 可）
+# このファイルが変わったら事前生成した回答を無効にする
+INTENT_SOURCE_FILES = {
+    "timetable": TIMETABLE_FILE,
+    **{name: corpus["files"] for name, corpus in CORPUS_REGISTRY.items()},
+}
+
+# この文字列を含む回答はエラーや情報なしの応答なので保存しない
+UNCACHEABLE_MARKERS = ("エラー", "できませんでした", "見つかりませんでした", "利用できません", "【簡易回答】")
+
+
+# ================================
+# 質問の正規化
+# ================================
+def normalize_question(text: str) -> str:
+    """全角半角・大文字小文字・空白・句読点の違いを吸収した検索キーを作る"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return re.sub(r"[\s、。,.!?！？「」『』()（）・…]+", "", text)
+
+
+# ================================
+# 元データの変更検知
+# ================================
+def source_fingerprint(intent: str):
+    """
+    意図の元データのファイルから指紋を作る。
+    複数のコーパスを合わせた回答（"domitory+cycle"）は、そのすべてのファイルを対象にする
+    """
+    patterns = [INTENT_SOURCE_FILES.get(name) for name in intent.split(INTENT_SEPARATOR)]
+    if not all(patterns):
+        return None
+    paths = sorted({path for pattern in patterns for path in glob.glob(os.path.join(DATA_DIR, pattern))})
+    parts = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        parts.append(f"{os.path.basename(path)}:{st.st_mtime_ns}:{st.st_size}")
+    return ";".join(parts) or None
+
+
+# ================================
+# SQLite
+# ================================
+def _connect():
+    conn = sqlite3.connect(ANSWER_CACHE_DB, timeout=5)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            question_key TEXT PRIMARY KEY,
+            question TEXT,
+            intent TEXT,
+            answer TEXT,
+            source_fingerprint TEXT,
+            hits INTEGER DEFAULT 0,
+            created TEXT
+        )
+    """)
+    return conn
+
+
+def store_answer(question: str, intent: str, answer: str) -> bool:
+    """事前生成した回答を保存する。保存しなかった場合は False"""
+    fingerprint = source_fingerprint(intent)
+    if fingerprint is None or not answer or any(m in answer for m in UNCACHEABLE_MARKERS):
+        return False
+    conn = _connect()
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO answer_cache
+            (question_key, question, intent, answer, source_fingerprint, hits, created)
+        VALUES (?, ?, ?, ?, ?, 0, ?)
+        """,
+        (normalize_question(question), question, intent, answer, fingerprint, datetime.now().isoformat()),
+    )
+    conn.commit()
+    conn.close()
+    return True
+
+
+def lookup_answer(question: str):
+    """事前生成済みの回答があれば返す。元データが更新されていれば破棄して None"""
+    key = normalize_question(question)
+    try:
+        conn = _connect()
+        row = conn.execute(
+            "SELECT intent, answer, source_fingerprint FROM answer_cache WHERE question_key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            conn.close()
+            return None
+        intent, answer, fingerprint = row
+        if fingerprint != source_fingerprint(intent):
+            conn.execute("DELETE FROM answer_cache WHERE question_key = ?", (key,))
+            answer = None
+        else:
+            conn.execute("UPDATE answer_cache SET hits = hits + 1 WHERE question_key = ?", (key,))
+        conn.commit()
+        conn.close()
+        return answer
+    except sqlite3.Error:
+        # キャッシュが使えなくても通常の回答生成にフォールバックする
+        return None
+
+
+def purge_stale_answers() -> int:
+    """元データが更新された回答をまとめて削除し、削除件数を返す"""
+    conn = _connect()
+    rows = conn.execute("SELECT question_key, intent, source_fingerprint FROM answer_cache").fetchall()
+    stale = [(key,) for key, intent, fingerprint in rows if fingerprint != source_fingerprint(intent)]
+    conn.executemany("DELETE FROM answer_cache WHERE question_key = ?", stale)
+    conn.commit()
+    conn.close()
+    return len(stale)
@@ -5,21 +5,55 @@ import sqlite3
 import html
 import re
 import time
+import math
 import logging
+import functools
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
 
+# 1回の再実行にかかった時間を計測する
+_script_start = time.perf_counter()
+
 BASE_DIR = os.path.dirname(__file__)  # app.py があるディレクトリ
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 # ===== 外部AIロジック =====
 from anan_ai import (
     ask_question,
-    load_rules_from_file,
-    initialize_vector_db
+    load_rule_dbs,
+    llm_breaker
 )
 
 # 授業変更
-from fetch_class_changes import fetch_class_changes
+from corpora import TIMETABLE_FILE
+import requests
+from fetch_class_changes import NOT_FOUND_MESSAGE
+from class_change_poller import (
+    start_poller,
+    poll_once,
+    get_current_changes,
+    get_changes_since,
+    start_of_yesterday,
+    format_change_events
+)
+
+# 事前生成した頻出質問の回答
+from answer_cache import lookup_answer
+
+# 履歴のエクスポート / インポート
+from history_io import ensure_history_schema, export_history, import_history
+
+# 管理者向けプロファイリング
+from profiling import request_profiler
+
+# 流量制御（プロセス全体で共有）
+from admission import (
+    rate_limiter,
+    llm_gate,
+    QueueFullError,
+    QueueTimeoutError
+)
 
 # ================================
 # 基本設定
@@ -42,39 +76,36 @@ logging.basicConfig(
 # ================================
 # CSS
 # ================================
+# ファイルの読み込みはプロセスごとに1回だけ行い、描画は毎回行う
+@st.cache_resource
 def load_css():
     try:
-        with open("style.css", "r", encoding="utf-8") as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        with open(os.path.join(BASE_DIR, "style.css"), "r", encoding="utf-8") as f:
+            return f.read()
     except Exception as e:
         logging.warning(f"CSS load failed: {e}")
+        return ""
 
-load_css()
+st.markdown(f"<style>{load_css()}</style>", unsafe_allow_html=True)
 
 
 # ================================
 # SQLite
 # ================================
+# テーブル作成はプロセスごとに1回だけ行う
+@st.cache_resource
 def init_db():
     conn = sqlite3.connect("history.db")
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            question TEXT,
-            answer TEXT,
-            timestamp TEXT
-        )
-    """)
-    conn.commit()
+    # 古いDBには page 列を追加する
+    ensure_history_schema(conn)
     conn.close()
 
-def add_history(q, a):
+def add_history(q, a, page="chat"):
     conn = sqlite3.connect("history.db")
     c = conn.cursor()
     c.execute(
-        "INSERT INTO history (question, answer, timestamp) VALUES (?, ?, ?)",
-        (q, a, datetime.now().isoformat())
+        "INSERT INTO history (question, answer, timestamp, page) VALUES (?, ?, ?, ?)",
+        (q, a, datetime.now().isoformat(), page)
     )
     conn.commit()
     conn.close()
@@ -115,12 +146,30 @@ def validate_input(text):
 # ================================
 # DoS対策 (連打防止)
 # ================================
+# プロキシ配下で運用する場合のみ X-Forwarded-For を信用する
+TRUST_PROXY_HEADERS = os.environ.get("ANAN_TRUST_PROXY_HEADERS") == "1"
+
+def get_client_id():
+    if TRUST_PROXY_HEADERS:
+        forwarded = st.context.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return st.context.ip_address or "local"
+
 def rate_limit(sec=5):
+    # 同じタブからの連打防止
     now = time.time()
     last = st.session_state.get("last_request_time",0)
     if now - last < sec:
         st.warning("少し待ってから再度実行してください")
         return False
+
+    # 同じIPからの大量アクセス防止（全セッション共通）
+    allowed, retry_after = rate_limiter.allow(get_client_id())
+    if not allowed:
+        st.warning(f"アクセスが集中しています。約{math.ceil(retry_after)}秒後に再度実行してください")
+        return False
+
     st.session_state.last_request_time = now
     return True
 
@@ -130,7 +179,7 @@ def rate_limit(sec=5):
 @st.cache_resource
 def load_all_data():
     # JSONを絶対パスで読み込む
-    timetable_path = os.path.join(DATA_DIR, "timetable1.json")
+    timetable_path = os.path.join(DATA_DIR, TIMETABLE_FILE)
     try:
         with open(timetable_path, "r", encoding="utf-8") as f:
             timetable = json.load(f)
@@ -138,28 +187,55 @@ def load_all_data():
         st.error(f"{timetable_path} が見つかりません。")
         return None
 
-    # DBロード用関数
-    def load_db(filename):
-        path = os.path.join(DATA_DIR, filename)
-        return initialize_vector_db(load_rules_from_file(path))
-
+    # 校則などのDBは corpora.py の登録簿から並列に取り込む
     return {
         "timetable": timetable,
-        "grooming": load_db("style.txt"),
-        "grades": load_db("grade.txt"),
-        "abstract": load_db("abstract.txt"),
-        "cycle": load_db("cycle.txt"),
-        "abroad": load_db("abroad.txt"),
-        "sinro": load_db("sinro.txt"),
-        "part": load_db("part.txt"),
-        "other": load_db("other.txt"),
-        "money": load_db("money.txt"),
-        "domitory": load_db("domitory.txt"),
-        "clab": load_db("clab.txt"),
+        "rules": load_rule_dbs(),
     }
 
 dbs = load_all_data()
 
+# 授業変更の定期取得（プロセスごとに1回だけ開始）
+@st.cache_resource
+def start_class_change_poller():
+    start_poller()
+
+start_class_change_poller()
+
+# ================================
+# 設定
+# ================================
+@st.cache_resource
+def load_config():
+    return {
+        "admin_pin": st.secrets.get("ADMIN_PIN"),
+    }
+
+config = load_config()
+
+# ================================
+# 実行時間の計測
+# ================================
+RUN_TIMING_HISTORY = 20
+
+def record_run_time(kind, name, start):
+    timings = st.session_state.setdefault("run_timings", [])
+    timings.append((kind, name, (time.perf_counter() - start) * 1000))
+    del timings[:-RUN_TIMING_HISTORY]
+
+def timed_fragment(name):
+    """パネルを st.fragment にし、操作時はそのパネルだけを再実行する"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper():
+            start = time.perf_counter()
+            try:
+                func()
+            finally:
+                record_run_time("fragment", name, start)
+        return st.fragment(wrapper)
+    return decorator
+
 # ================================
 # 管理者認証
 # ================================
@@ -168,14 +244,29 @@ if "is_admin" not in st.session_state:
 
 with st.sidebar:
     st.markdown("### 管理者")
-    pin = st.text_input("管理者PIN",type="password")
-    if pin and pin == st.secrets.get("ADMIN_PIN"):
-        st.session_state.is_admin = True
+    if not st.session_state.is_admin:
+        pin = st.text_input("管理者PIN",type="password")
+        if pin and pin == config["admin_pin"]:
+            st.session_state.is_admin = True
+    if st.session_state.is_admin:
         st.success("管理者モード")
+        if llm_breaker.state != llm_breaker.CLOSED:
+            st.warning("LLMへの呼び出しを遮断中です（簡易回答を返しています）")
+        with st.expander("プロファイリング"):
+            n_profile = st.number_input("次のN件を計測", min_value=0, max_value=50, value=5, step=1)
+            if st.button("計測を開始"):
+                request_profiler.arm(n_profile)
+            st.caption(f"残り {request_profiler.remaining} 件（結果は履歴ページに表示）")
+        with st.expander("再実行時間（直近）"):
+            for kind, name, ms in reversed(st.session_state.get("run_timings", [])):
+                st.caption(f"{kind} / {name}: {ms:.1f} ms")
 
 # ================================
 # ページ管理
 # ================================
+def set_page(target):
+    st.session_state.page = target
+
 def nav_button(label, target):
     active = st.session_state.page == target
 
@@ -184,11 +275,9 @@ def nav_button(label, target):
         unsafe_allow_html=True
     )
 
-    clicked = st.button(label,key=f"nav_{target}")
+    # コールバックで遷移先を設定し、クリック時の1回の再実行だけで切り替える
+    st.button(label,key=f"nav_{target}",on_click=set_page,args=(target,))
     st.markdown("</div>", unsafe_allow_html=True)
-    if clicked and not active:
-        st.session_state.page = target
-        st.rerun()
 
 if "page" not in st.session_state:
     st.session_state.page = "home"
@@ -242,7 +331,56 @@ if page == "home":
 # ================================
 # ページ：質問
 # ================================
-elif page == "chat":
+def handle_chat_submit(q):
+    if not rate_limit():
+        return
+
+    ok,msg = validate_input(q)
+    if not ok:
+        st.error(msg)
+        return
+
+    status = st.empty()
+
+    def show_queue_position(pos):
+        status.info(f"混み合っています。順番待ち: {pos}番目")
+
+    # 同時実行枠はLLMを呼ぶ間だけ確保する（検索や時間割の処理は順番待ちしない）
+    @contextmanager
+    def llm_slot():
+        with llm_gate.slot(on_wait=show_queue_position):
+            status.empty()
+            yield
+
+    try:
+        # 頻出質問は事前生成した回答を返し、LLMを呼ばない
+        ans = lookup_answer(q)
+        if ans is None:
+            with st.spinner("考えています..."):
+                ans = ask_question(q, dbs["timetable"], dbs["rules"], llm_slot=llm_slot)
+        
+        safe_q = html.escape(q)
+        safe_a = html.escape(ans)
+
+        if len(safe_a) > 120:
+            with st.expander("回答を表示"):
+                st.write(safe_a)
+        else:
+            st.success(ans)
+        add_history(safe_q,safe_a)
+
+    except QueueFullError:
+        status.empty()
+        st.warning("現在大変混み合っています。しばらくしてから再度お試しください。")
+    except QueueTimeoutError:
+        status.empty()
+        st.warning("待ち時間が長くなったため中断しました。もう一度お試しください。")
+    except Exception as e:
+        logging.warning(e)
+        st.error("内部エラーが発生しました")
+
+@timed_fragment("chat")
+def chat_panel():
     st.write("例: 1年2組 火曜3限 / 髪型の校則は？ / 赤点の基準は？")
     q = st.text_input(
         "",
@@ -251,50 +389,15 @@ elif page == "chat":
     )
 
     if st.button("送信"):
-        if not rate_limit():
-            st.stop()
-
-        ok,msg = validate_input(q)
-        if not ok:
-            st.error(msg)
-            st.stop()
-
-        try:
-            with st.spinner("考えています..."):
-                ans = ask_question(
-                    q,
-                    dbs["timetable"],
-                    dbs["grooming"],
-                    dbs["grades"],
-                    dbs["abstract"],
-                    dbs["cycle"],
-                    dbs["abroad"],
-                    dbs["sinro"],
-                    dbs["part"],
-                    dbs["other"],
-                    dbs["money"],
-                    dbs["domitory"],
-                    dbs["clab"],
-                )
-            
-            safe_q = html.escape(q)
-            safe_a = html.escape(ans)
-
-            if len(safe_a) > 120:
-                with st.expander("回答を表示"):
-                    st.write(safe_a)
-            else:
-                st.success(ans)
-            add_history(safe_q,safe_a)
-        
-        except Exception as e:
-            logging.warning(e)
-            st.error("内部エラーが発生しました")
+        # 管理者が計測を有効にしているときだけプロファイルを取る
+        with request_profiler.profile("chat", question=q, page="chat"):
+            handle_chat_submit(q)
 
 # ================================
 # ページ：授業変更
 # ================================
-elif page == "change":
+@timed_fragment("change")
+def change_panel():
     st.header("授業変更")
     st.write("例：3I 4I などクラスのみで")
     c = st.text_input(
@@ -302,16 +405,109 @@ elif page == "change":
         placeholder="質問してみましょう",
         label_visibility="collapsed"
     )
+    mode = st.radio(
+        "表示",
+        ["現在の授業変更", "昨日からの変更"],
+        horizontal=True,
+        label_visibility="collapsed"
+    )
     if st.button("取得"):
-        result = fetch_class_changes(c if c else None)
+        target = c.strip() if c and c.strip() else None
+        # バックグラウンドで取得済みの記録から回答する
+        result, fetched_at = get_current_changes(target)
+        if result is None:
+            # まだ一度も取得していなければ、その場で取得して記録する
+            try:
+                poll_once()
+            except requests.RequestException:
+                st.error("授業変更のページに接続できませんでした。しばらくしてからもう一度試してください。")
+                return
+            result, fetched_at = get_current_changes(target)
+        if result is None:
+            result = NOT_FOUND_MESSAGE
+        elif mode == "昨日からの変更":
+            result = format_change_events(get_changes_since(start_of_yesterday(), target), target)
+        if fetched_at:
+            st.caption(f"最終取得: {fetched_at.strftime('%Y/%m/%d %H:%M')}")
         st.info(result)
-        add_history(c or "全体", html.escape(result))
+        add_history(c or "全体", html.escape(result), page="change")
 
 # ================================
 # ページ：履歴
 # ================================
-elif page == "history":
+def show_profiles():
+    profiles = request_profiler.list_profiles()
+    if not profiles:
+        st.caption("計測結果はまだありません。サイドバーから計測を開始してください。")
+        return
+    labels = [
+        f"{p['started_at']} / {p['elapsed_sec']:.2f}秒 / {p.get('question', p['label'])}"
+        for p in profiles
+    ]
+    idx = st.selectbox("計測結果", range(len(profiles)), format_func=lambda i: labels[i])
+    selected = profiles[idx]
+    st.dataframe(request_profiler.top_functions(selected["name"]))
+    with open(request_profiler.profile_path(selected["name"]), "rb") as f:
+        st.download_button("プロファイルをダウンロード (.prof)", f.read(), file_name=f"{selected['name']}.prof")
+
+def show_history_io():
+    st.markdown("**エクスポート**")
+    col_fmt, col_page = st.columns(2)
+    with col_fmt:
+        fmt = st.selectbox("形式", ["csv", "parquet"])
+    with col_page:
+        page_filter = st.selectbox("ページ", ["すべて", "chat", "change"])
+    col_start, col_end = st.columns(2)
+    with col_start:
+        start = st.date_input("開始日", value=None)
+    with col_end:
+        end = st.date_input("終了日", value=None)
+    if st.button("エクスポートを作成"):
+        with tempfile.NamedTemporaryFile(suffix=f".{fmt}", delete=False) as tmp:
+            path = tmp.name
+        try:
+            n = export_history(
+                path,
+                fmt,
+                start,
+                end,
+                None if page_filter == "すべて" else page_filter,
+                db_path="history.db"
+            )
+            with open(path, "rb") as f:
+                st.download_button(f"ダウンロード（{n}件）", f.read(), file_name=f"history.{fmt}")
+        except Exception as e:
+            logging.warning(e)
+            st.error(f"エクスポートに失敗しました: {e}")
+        finally:
+            os.remove(path)
+
+    st.markdown("**インポート**")
+    uploaded = st.file_uploader("履歴ファイル（.csv / .parquet）", type=["csv", "parquet"])
+    if uploaded is not None and st.button("取り込む"):
+        suffix = os.path.splitext(uploaded.name)[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+            tmp.write(uploaded.getbuffer())
+            path = tmp.name
+        try:
+            n, invalid = import_history(path, db_path="history.db")
+            st.success(f"{n} 件を取り込みました")
+            if invalid:
+                st.warning(f"日時が読めない、または質問・回答が空の {invalid} 件をスキップしました")
+        except Exception as e:
+            logging.warning(e)
+            st.error(f"インポートに失敗しました: {e}")
+        finally:
+            os.remove(path)
+
+@timed_fragment("history")
+def history_panel():
     st.header("質問履歴")
+    if st.session_state.is_admin:
+        with st.expander("⏱️ プロファイル結果（累積時間の上位）"):
+            show_profiles()
+        with st.expander("📦 エクスポート / インポート"):
+            show_history_io()
     if st.session_state.is_admin:
         if st.button("🗑️ 履歴をすべて削除する"):
             conn = sqlite3.connect("history.db")
@@ -319,7 +515,7 @@ elif page == "history":
             c.execute("DELETE FROM history")
             conn.commit()
             conn.close()
-            st.rerun()
+            st.rerun(scope="fragment")
 
     history_data = load_history()
 
@@ -354,4 +550,13 @@ elif page == "history":
                 if st.session_state.is_admin:
                     if st.button("削除", key=f"del_{h_id}"):
                         delete_history_item(h_id)
-                        st.rerun()
\ No newline at end of file
+                        st.rerun(scope="fragment")
+
+if page == "chat":
+    chat_panel()
+elif page == "change":
+    change_panel()
+elif page == "history":
+    history_panel()
+
+record_run_time("app", page, _script_start)
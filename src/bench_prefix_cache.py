@@ -0,0 +1,109 @@
+"""
+プロンプトのレイアウト（v1: 1メッセージ混在 / v2: 固定system + 可変user）ごとに、
+プレフィックスキャッシュを模擬したスタブサーバーで最初のトークンまでの時間（TTFT）を比較する。
+
+    python bench_prefix_cache.py --requests 200 --prefill-per-char 0.0005
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import statistics
+import time
+from openai import OpenAI
+from prompts import build_messages
+from stub_llm_server import StubConfig, start_stub_server
+
+BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+
+# ==== ベンチマーク用の問い合わせを作る ====
+def load_rule_chunks():
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(DATA_DIR, "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            chunks.extend(t.strip() for t in f.read().split("\n\n") if t.strip())
+    return chunks
+
+
+def load_timetable_days():
+    with open(os.path.join(DATA_DIR, "timetable1.json"), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    days = []
+    for grades in data.values():
+        for grade, classes in grades.items():
+            for class_name, week in classes.items():
+                for day, periods in week.items():
+                    lines = [f"{day}{p['時限']}限: {p['科目']}（{p['教員']}）@{p['教室']}" for p in periods]
+                    days.append((f"{grade}{class_name}の{day}の時間割を教えてください。", "\n".join(lines)))
+    return days
+
+
+def make_workload(n: int, seed: int = 0):
+    """時間割と校則の問い合わせを半々で混ぜた (prompt_type, context, question_text) のリスト"""
+    rng = random.Random(seed)
+    chunks = load_rule_chunks()
+    days = load_timetable_days()
+    workload = []
+    for _ in range(n):
+        if rng.random() < 0.5:
+            question_text, context = rng.choice(days)
+            workload.append(("timetable", context, question_text))
+        else:
+            context = "\n---\n".join(rng.sample(chunks, 5))
+            question_text = "ユーザーの質問「規則について教えて」に対する回答を、以下の【校則データ】に基づいて生成してください。"
+            workload.append(("rules", context, question_text))
+    return workload
+
+
+# ==== 計測 ====
+def measure_ttft(client: OpenAI, messages) -> float:
+    start = time.perf_counter()
+    stream = client.chat.completions.create(
+        model="stub", messages=messages, max_tokens=8, temperature=0.0, stream=True
+    )
+    ttft = None
+    for chunk in stream:
+        if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+            ttft = time.perf_counter() - start
+    stream.close()
+    return ttft
+
+
+def run(version: str, workload, config: StubConfig):
+    # バージョンごとにサーバーを立て直し、キャッシュを空の状態から始める
+    server, base_url = start_stub_server(config=config)
+    client = OpenAI(base_url=base_url, api_key="EMPTY", max_retries=0)
+    try:
+        ttfts = [
+            measure_ttft(client, build_messages(prompt_type, context, question_text, version=version))
+            for prompt_type, context, question_text in workload
+        ]
+    finally:
+        server.shutdown()
+    ttfts.sort()
+    return {
+        "version": version,
+        "mean": statistics.mean(ttfts),
+        "p50": statistics.median(ttfts),
+        "p95": ttfts[int(0.95 * (len(ttfts) - 1))],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="プロンプトレイアウト別のTTFTベンチマーク")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--prefill-per-char", type=float, default=0.0005, help="1文字あたりのプレフィル時間（秒）")
+    parser.add_argument("--ttft", type=float, default=0.01, help="プレフィル以外の固定遅延（秒）")
+    args = parser.parse_args()
+
+    workload = make_workload(args.requests)
+    config = StubConfig(ttft=args.ttft, token_delay=0.0, prefill_per_char=args.prefill_per_char, prefix_cache=True)
+
+    print(f"{'layout':<8}{'mean[ms]':>10}{'p50[ms]':>10}{'p95[ms]':>10}")
+    results = [run(v, workload, config) for v in ("v1", "v2")]
+    for r in results:
+        print(f"{r['version']:<8}{r['mean'] * 1000:>10.1f}{r['p50'] * 1000:>10.1f}{r['p95'] * 1000:>10.1f}")
+    print(f"v2 / v1 (mean): {results[1]['mean'] / results[0]['mean']:.2f}")
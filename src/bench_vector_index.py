@@ -0,0 +1,102 @@
+"""
+ベクトルインデックスの方式ごとに、合成データでチャンク数を増やしながら
+構築時間・メモリ量・recall@k・1クエリあたりの検索時間を比較する。
+正解は bruteforce（厳密検索）の上位 k 件。
+
+    python bench_vector_index.py --sizes 1000,10000,100000,1000000 --dim 128
+    python bench_vector_index.py --backends ivf --params '{"ivf": {"n_probe": 16}}'
+"""
+import argparse
+import gc
+import json
+import statistics
+import time
+
+import numpy as np
+
+from vector_index import INDEX_BACKENDS, _normalize, _top_k
+
+
+# ==== 合成データ ====
+def make_dataset(n: int, dim: int, n_queries: int, seed: int = 0):
+    """
+    トピックごとにまとまった埋め込みを模して、クラスタ中心の周りにばらつかせたベクトルを作る。
+    質問はデータ点に小さなノイズを加えたもの。
+    """
+    rng = np.random.default_rng(seed)
+    n_topics = max(1, n // 100)
+    centers = rng.standard_normal((n_topics, dim), dtype=np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 65536):
+        end = min(n, start + 65536)
+        topics = rng.integers(0, n_topics, end - start)
+        vectors[start:end] = centers[topics] + 0.6 * rng.standard_normal((end - start, dim), dtype=np.float32)
+    vectors = _normalize(vectors)
+    picks = rng.choice(n, n_queries, replace=n_queries > n)
+    queries = _normalize(vectors[picks] + 0.3 * rng.standard_normal((n_queries, dim), dtype=np.float32) / np.sqrt(dim))
+    return vectors, queries
+
+
+def exact_top_k(vectors, queries, k):
+    truth = []
+    for q in queries:
+        truth.append(set(_top_k(vectors @ q, k).tolist()))
+    return truth
+
+
+# ==== 計測 ====
+def run(backend, vectors, queries, truth, k, params):
+    chunks = range(len(vectors))  # 本文は使わないので番号で代用する
+    start = time.perf_counter()
+    index = INDEX_BACKENDS[backend](chunks, vectors, **params)
+    build_sec = time.perf_counter() - start
+
+    latencies, recalls = [], []
+    for q, expected in zip(queries, truth):
+        start = time.perf_counter()
+        ids, _ = index.search_ids(q, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(ids.tolist()) & expected) / len(expected))
+    latencies.sort()
+    result = {
+        "backend": backend,
+        "n": len(vectors),
+        "build_sec": build_sec,
+        "memory_mb": index.memory_bytes() / 1024 / 1024,
+        "recall": statistics.mean(recalls),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+    del index
+    gc.collect()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ベクトルインデックスのスケーリングベンチマーク")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="チャンク数（カンマ区切り）")
+    parser.add_argument("--backends", default=",".join(INDEX_BACKENDS), help="比較する方式（カンマ区切り）")
+    parser.add_argument("--dim", type=int, default=128, help="ベクトルの次元（本番の e5-large は 1024）")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5, help="recall@k の k（本番の検索件数は 5）")
+    parser.add_argument("--params", default="{}", help='方式ごとのパラメータ（JSON、例: {"graph": {"ef": 128}}）')
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    params = json.loads(args.params)
+    results = []
+    print(f"{'backend':<12}{'n':>10}{'build[s]':>10}{'mem[MB]':>10}{'R@' + str(args.k):>8}{'p50[ms]':>10}{'p95[ms]':>10}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        vectors, queries = make_dataset(n, args.dim, args.queries)
+        truth = exact_top_k(vectors, queries, args.k)
+        for backend in args.backends.split(","):
+            r = run(backend, vectors, queries, truth, args.k, params.get(backend, {}))
+            results.append(r)
+            print(f"{r['backend']:<12}{r['n']:>10}{r['build_sec']:>10.2f}{r['memory_mb']:>10.1f}"
+                  f"{r['recall']:>8.3f}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}")
+        del vectors, queries
+        gc.collect()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,59 @@
+# ================================
+# チャンク分割
+# ================================
+# いずれの関数も [(チャンク本文, 開始位置, 終了位置), ...] を返す。
+# 位置は元テキスト中の文字オフセットで、評価時に別の分割方法のチャンクと
+# 段落（正解チャンクID）を対応付けるのに使う。
+
+
+def _strip_span(text: str, start: int, end: int):
+    piece = text[start:end]
+    stripped = piece.strip()
+    if not stripped:
+        return None
+    offset = piece.index(stripped)
+    return stripped, start + offset, start + offset + len(stripped)
+
+
+def _split_on(text: str, sep: str):
+    spans = []
+    pos = 0
+    while pos <= len(text):
+        end = text.find(sep, pos)
+        if end == -1:
+            end = len(text)
+        span = _strip_span(text, pos, end)
+        if span:
+            spans.append(span)
+        pos = end + len(sep)
+    return spans
+
+
+def split_paragraphs(text: str):
+    """空行で区切って条文（段落）単位に分割する（本番の分割方法）"""
+    return _split_on(text, "\n\n")
+
+
+def split_lines(text: str):
+    """1行ずつに分割する"""
+    return _split_on(text, "\n")
+
+
+def split_window(text: str, size: int = 200, overlap: int = 50):
+    """固定文字数の窓で重なりを持たせて分割する"""
+    spans = []
+    step = max(1, size - overlap)
+    for start in range(0, len(text), step):
+        span = _strip_span(text, start, min(len(text), start + size))
+        if span:
+            spans.append(span)
+        if start + size >= len(text):
+            break
+    return spans
+
+
+CHUNKERS = {
+    "paragraph": split_paragraphs,
+    "line": split_lines,
+    "window": split_window,
+}
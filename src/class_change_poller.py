@@ -0,0 +1,206 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fetch_class_changes import fetch_class_changes_text, filter_class_changes
+
+# ================================
+# 設定
+# ================================
+CLASS_CHANGE_DB = os.environ.get("ANAN_CLASS_CHANGE_DB", "history.db")
+POLL_INTERVAL = float(os.environ.get("ANAN_CLASS_CHANGE_POLL_SEC", "300"))  # 取得間隔（秒）
+
+# 複数プロセスで起動しても学校サイトへの取得は1プロセスだけが行う
+_LEASE_NAME = "class_change_poller"
+_OWNER = uuid.uuid4().hex
+
+_poller_thread = None
+_poller_lock = threading.Lock()
+
+# 「10月20日(月)」「10/20（月）」のような日付の見出し行（日付で始まり、時限を含まない行）
+_DATE_HEADING = re.compile(r"^[\s(（【]*(\d{1,2}\s*月\s*\d{1,2}\s*日|\d{1,2}\s*/\s*\d{1,2})")
+
+
+# ================================
+# SQLite
+# ================================
+def _connect():
+    conn = sqlite3.connect(CLASS_CHANGE_DB, timeout=5)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS class_change_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fetched_at TEXT NOT NULL,
+            text TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS class_change_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            detected_at TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            heading TEXT NOT NULL DEFAULT '',
+            line TEXT NOT NULL
+        )
+    """)
+    # 見出しの列が無い古いDBに列を追加する
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(class_change_events)")}
+    if "heading" not in columns:
+        conn.execute("ALTER TABLE class_change_events ADD COLUMN heading TEXT NOT NULL DEFAULT ''")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_class_change_events_time ON class_change_events (detected_at)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS poller_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL
+        )
+    """)
+    return conn
+
+
+def _acquire_lease(conn, ttl: float) -> bool:
+    now = time.time()
+    conn.execute(
+        """
+        INSERT INTO poller_leases (name, owner, expires) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires
+        WHERE poller_leases.owner = excluded.owner OR poller_leases.expires < ?
+        """,
+        (_LEASE_NAME, _OWNER, now + ttl, now),
+    )
+    conn.commit()
+    row = conn.execute("SELECT owner FROM poller_leases WHERE name = ?", (_LEASE_NAME,)).fetchone()
+    return row is not None and row[0] == _OWNER
+
+
+# ================================
+# 取得と差分の記録
+# ================================
+def _lines_with_headings(text: str):
+    """本文の各行を、直前の日付の見出しと組にした {(見出し, 行), ...} にする（見出し行そのものは含めない）"""
+    pairs = set()
+    heading = ""
+    for line in text.split("\n"):
+        if _DATE_HEADING.match(line) and "限" not in line:
+            heading = line.strip()
+            continue
+        pairs.add((heading, line))
+    return pairs
+
+
+def poll_once():
+    """
+    授業変更ページを取得し、前回のスナップショットとの差分をイベントとして記録する。
+    記録したイベント数を返す（取得に失敗した場合は None）。
+    """
+    text = fetch_class_changes_text()
+    if text is None:
+        print("警告: 授業変更ページの本文が取得できませんでした。（構造が変わった可能性）")
+        return None
+
+    now = datetime.now().isoformat(timespec="seconds")
+    conn = _connect()
+    row = conn.execute("SELECT text FROM class_change_snapshots ORDER BY id DESC LIMIT 1").fetchone()
+    # 同じ行が別の日付の下に出ることもあるので、見出しと組にして比較する
+    previous = _lines_with_headings(row[0]) if row else set()
+    current = _lines_with_headings(text)
+
+    # 最初のスナップショットでは全行を「追加」として記録する
+    events = [(now, "added", heading, line) for heading, line in sorted(current - previous)]
+    events += [(now, "removed", heading, line) for heading, line in sorted(previous - current)]
+
+    conn.executemany(
+        "INSERT INTO class_change_events (detected_at, kind, heading, line) VALUES (?, ?, ?, ?)", events
+    )
+    if row is None or events:
+        conn.execute("INSERT INTO class_change_snapshots (fetched_at, text) VALUES (?, ?)", (now, text))
+    else:
+        # 内容が同じなら最終取得時刻だけ更新する
+        conn.execute(
+            "UPDATE class_change_snapshots SET fetched_at = ? "
+            "WHERE id = (SELECT MAX(id) FROM class_change_snapshots)",
+            (now,),
+        )
+    # 古いスナップショットは差分に使わないので直近だけ残す
+    conn.execute(
+        "DELETE FROM class_change_snapshots WHERE id < (SELECT MAX(id) FROM class_change_snapshots) - 10"
+    )
+    conn.commit()
+    conn.close()
+    return len(events)
+
+
+def start_poller(interval: float = POLL_INTERVAL):
+    """授業変更の定期取得をバックグラウンドで開始する（プロセスごとに1回だけ有効）"""
+    global _poller_thread
+    with _poller_lock:
+        if _poller_thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    conn = _connect()
+                    leader = _acquire_lease(conn, ttl=interval * 2)
+                    conn.close()
+                    if leader:
+                        poll_once()
+                except Exception as e:
+                    print(f"警告: 授業変更の取得に失敗しました: {e}")
+                time.sleep(interval)
+
+        _poller_thread = threading.Thread(target=loop, name="class-change-poller", daemon=True)
+        _poller_thread.start()
+
+
+# ================================
+# ローカルの記録から回答する
+# ================================
+def get_current_changes(target_class=None):
+    """
+    最新のスナップショットから (テキスト, 取得時刻) を返す。
+    まだ1回も取得していない場合は (None, None)。
+    """
+    conn = _connect()
+    row = conn.execute(
+        "SELECT text, fetched_at FROM class_change_snapshots ORDER BY id DESC LIMIT 1"
+    ).fetchone()
+    conn.close()
+    if row is None:
+        return None, None
+    text, fetched_at = row
+    return filter_class_changes(text, target_class), datetime.fromisoformat(fetched_at)
+
+
+def get_changes_since(since: datetime, target_class=None):
+    """since 以降に検出された変更イベント [(検出時刻, 'added'|'removed', 日付の見出し, 行), ...] を返す"""
+    conn = _connect()
+    rows = conn.execute(
+        "SELECT detected_at, kind, heading, line FROM class_change_events WHERE detected_at >= ? ORDER BY id",
+        (since.isoformat(timespec="seconds"),),
+    ).fetchall()
+    conn.close()
+    return [
+        (datetime.fromisoformat(t), kind, heading, line)
+        for t, kind, heading, line in rows
+        if not target_class or target_class in line
+    ]
+
+
+def start_of_yesterday() -> datetime:
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=1)
+
+
+def format_change_events(events, target_class=None) -> str:
+    if not events:
+        label = f"{target_class} の" if target_class else ""
+        return f"{label}新しい授業変更はありません。"
+    marks = {"added": "追加", "removed": "削除"}
+    return "\n".join(
+        f"[{marks.get(kind, kind)} {t.strftime('%m/%d %H:%M')}] " + (f"{heading} {line}" if heading else line)
+        for t, kind, heading, line in events
+    )
@@ -0,0 +1,154 @@
+"""
+RAG対象のコーパス（校則などの文書）の登録簿と、読み込み・チャンク分割・ベクトル化の処理。
+
+コーパスを追加するときは CORPUS_REGISTRY に1件足すか、
+ANAN_CORPUS_REGISTRY に指定した JSON ファイルで追加・上書きする（コードの変更は不要）。
+
+    {"library": {"files": "library/*.txt", "keywords": ["図書館", "貸出"], "display_name": "図書館"}}
+"""
+import glob
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chunking import split_paragraphs
+from vector_index import build_index
+
+BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(BASE_DIR, "data")
+
+# 複数のコーパスの条文を合わせて回答したときの意図の表記（例: "domitory+cycle"）
+INTENT_SEPARATOR = "+"
+
+# 時間割はRAGではなくJSONから該当部分を取り出す
+TIMETABLE_FILE = "timetable1.json"
+TIMETABLE_KEYWORDS = ["時間割", "何組", "何限", "教室", "授業", "今日", "限"]
+
+# ================================
+# コーパスの登録簿
+# ================================
+# コーパス名（= 意図） -> 設定
+#   files: DATA_DIR からの相対パス（glob 可）
+#   keywords: 質問にこの語が含まれたらこのコーパスを検索する（上から順に判定）
+#   display_name: 回答できないときのメッセージに使う名前
+CORPUS_REGISTRY = {
+    "grooming": {
+        "files": "style.txt",
+        "keywords": ["身だしなみ", "髪", "服装", "制服", "略装", "靴", "アクセサリー"],
+        "display_name": "身だしなみ校則",
+    },
+    "grades": {
+        "files": "grade.txt",
+        "keywords": ["成績", "成績表", "単位", "点数", "GPA", "評価", "赤点", "原点", "何点"],
+        "display_name": "成績表ルール",
+    },
+    "abstract": {
+        "files": "abstract.txt",
+        "keywords": ["欠席", "欠課", "ストライキ", "交通機関", "汽車", "病気", "インフル", "特別"],
+        "display_name": "特別欠席ルール",
+    },
+    "cycle": {
+        "files": "cycle.txt",
+        "keywords": ["自転車", "駐輪場", "バイク", "通学", "原付", "二輪車"],
+        "display_name": "自転車規則",
+    },
+    "abroad": {
+        "files": "abroad.txt",
+        "keywords": ["留学", "海外", "研修", "台湾", "ニュージーランド", "インターンシップ"],
+        "display_name": "留学・海外研修",
+    },
+    "sinro": {
+        "files": "sinro.txt",
+        "keywords": ["進路", "就職", "進学", "大学", "専攻科", "推薦", "求人", "企業", "編入"],
+        "display_name": "進路",
+    },
+    "part": {
+        "files": "part.txt",
+        "keywords": ["アルバイト", "バイト"],
+        "display_name": "アルバイト・課外活動",
+    },
+    "other": {
+        "files": "other.txt",
+        "keywords": ["校則", "規則", "携帯電話", "スマホ", "スマートフォン", "いじめ", "始業時間", "授業時間",
+                     "コース配属", "保護者面談", "高専", "5年一貫"],
+        "display_name": "その他規則",
+    },
+    "money": {
+        "files": "money.txt",
+        "keywords": ["奨学金", "学費", "授業料", "免除", "お金", "費用", "振込"],
+        "display_name": "奨学金・学費",
+    },
+    "domitory": {
+        "files": "domitory.txt",
+        "keywords": ["寮", "寮生活", "阿南寮", "門限", "外泊", "帰省", "部屋"],
+        "display_name": "寮生活",
+    },
+    "clab": {
+        "files": "clab.txt",
+        "keywords": ["部活", "部活動", "クラブ", "サークル", "大会", "兼部"],
+        "display_name": "部活動",
+    },
+}
+
+# JSONファイルでコーパスを追加・上書きできるようにする
+_override_path = os.environ.get("ANAN_CORPUS_REGISTRY")
+if _override_path:
+    with open(_override_path, "r", encoding="utf-8") as f:
+        for _name, _corpus in json.load(f).items():
+            CORPUS_REGISTRY.setdefault(_name, {}).update(_corpus)
+
+
+def corpus_files(name: str):
+    """コーパスに含まれるファイルのパスを名前順に返す"""
+    return sorted(glob.glob(os.path.join(DATA_DIR, CORPUS_REGISTRY[name]["files"])))
+
+
+# ================================
+# 取り込み
+# ================================
+def _read_chunks(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    # ファイルをまたいで段落がつながらないよう、ファイルごとに分割する
+    return [chunk for chunk, _, _ in split_paragraphs(text)]
+
+
+def ingest_corpora(encode, names=None, max_workers: int | None = None):
+    """
+    登録済みコーパスを読み込み、チャンク分割・ベクトル化してインデックスを作る。
+    ファイルの読み込みとインデックス構築はスレッドで並列に行い、
+    ベクトル化は全コーパスのチャンクをまとめて encode(chunks) 1回で行う。
+    戻り値: {コーパス名: インデックス（ファイルやチャンクが無ければ None）}
+    """
+    names = list(CORPUS_REGISTRY if names is None else names)
+    start = time.perf_counter()
+
+    files = {name: corpus_files(name) for name in names}
+    for name, paths in files.items():
+        if not paths:
+            print(f"警告: コーパス '{name}' のファイル '{CORPUS_REGISTRY[name]['files']}' が見つかりません。DBは無効化されます。")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        all_paths = [path for name in names for path in files[name]]
+        chunks_by_path = dict(zip(all_paths, pool.map(_read_chunks, all_paths)))
+        chunks = {name: [c for path in files[name] for c in chunks_by_path[path]] for name in names}
+
+        all_chunks = [c for name in names for c in chunks[name]]
+        vectors = encode(all_chunks) if all_chunks else []
+
+        offsets = {}
+        pos = 0
+        for name in names:
+            offsets[name] = (pos, pos + len(chunks[name]))
+            pos += len(chunks[name])
+
+        def build(name):
+            begin, end = offsets[name]
+            return build_index(chunks[name], vectors[begin:end]) if end > begin else None
+
+        dbs = dict(zip(names, pool.map(build, names)))
+
+    print(f"--- INFO: {len(names)} コーパス / {len(all_paths)} ファイル / {len(all_chunks)} チャンクを "
+          f"{time.perf_counter() - start:.2f} 秒で取り込みました ---")
+    return dbs
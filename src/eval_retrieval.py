@@ -0,0 +1,200 @@
+"""
+RAG検索の品質と速度を評価する（LLMは使わない）。
+
+data/gold/<コーパス名>.jsonl の正解セット（{"question": ..., "expected": [段落ID, ...]}）に対し、
+チャンク分割・埋め込みモデル・検索方式の組み合わせごとに
+recall@k、MRR、インデックス構築時間、インデックスのメモリ量、1クエリあたりの検索時間を出力する。
+段落IDは chunking.split_paragraphs で分割したときの0始まりの番号。
+検索方式は本番で使う vector_index の各方式（bruteforce / ivf / graph）と、比較用の sklearn / numpy。
+
+    python eval_retrieval.py
+    python eval_retrieval.py --chunkers paragraph,window --k 1,3,5 --similarity bruteforce,ivf,sklearn
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from chunking import CHUNKERS, split_paragraphs
+from vector_index import INDEX_BACKENDS, _normalize, build_index
+
+BASE_DIR = os.path.dirname(__file__)
+DATA_DIR = os.path.join(BASE_DIR, "data")
+GOLD_DIR = os.path.join(DATA_DIR, "gold")
+DEFAULT_MODEL = "intfloat/multilingual-e5-large"
+
+
+# ==== 正解セットとコーパスの読み込み ====
+def load_gold_sets(corpora=None):
+    gold = {}
+    for path in sorted(glob.glob(os.path.join(GOLD_DIR, "*.jsonl"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if corpora and name not in corpora:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            gold[name] = [json.loads(line) for line in f if line.strip()]
+    return gold
+
+
+def load_corpus(name: str) -> str:
+    with open(os.path.join(DATA_DIR, f"{name}.txt"), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def paragraph_ids_for_spans(text: str, spans):
+    """各チャンクが重なる段落IDの集合を返す（分割方法が違っても正解と照合できるようにする）"""
+    paragraphs = split_paragraphs(text)
+    ids = []
+    for _, start, end in spans:
+        ids.append({i for i, (_, p_start, p_end) in enumerate(paragraphs) if start < p_end and p_start < end})
+    return ids
+
+
+# ==== 類似度計算 ====
+def search_sklearn(query_vector, vectors, normalized, k):
+    # vector_index 導入前の本番（get_rule_context_from_rag）と同じ計算
+    similarities = cosine_similarity(query_vector.reshape(1, -1), vectors)
+    return np.argsort(similarities[0])[-k:][::-1]
+
+
+def search_numpy(query_vector, vectors, normalized, k):
+    # 正規化済み行列との内積 + 部分ソート
+    q = query_vector / np.linalg.norm(query_vector)
+    scores = normalized @ q
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+SIMILARITIES = {
+    "sklearn": search_sklearn,
+    "numpy": search_numpy,
+}
+# 検索方式の一覧（本番の vector_index の方式 + 比較用の類似度計算）
+SEARCH_METHODS = [*INDEX_BACKENDS, *SIMILARITIES]
+
+
+# ==== 評価 ====
+def build_corpus_index(model, text, chunker, similarity):
+    """
+    コーパスをチャンク分割・ベクトル化する。
+    similarity が vector_index の方式なら、本番と同じ build_index でインデックスも作る
+    """
+    start = time.perf_counter()
+    spans = CHUNKERS[chunker](text)
+    chunks = [c for c, _, _ in spans]
+    vectors = np.asarray(model.encode(chunks, show_progress_bar=False), dtype=np.float32)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = build_index(chunks, vectors, backend=similarity) if similarity in INDEX_BACKENDS else None
+    build_sec = time.perf_counter() - start
+    memory = index.memory_bytes() if index is not None else vectors.nbytes + normalized.nbytes
+    memory += sum(len(c.encode("utf-8")) for c in chunks)
+    return {
+        "vectors": vectors,
+        "normalized": normalized,
+        "index": index,
+        "paragraph_ids": paragraph_ids_for_spans(text, spans),
+        "build_sec": build_sec,
+        "memory_bytes": memory,
+    }
+
+
+def evaluate(model, gold, chunker, similarity, ks):
+    max_k = max(ks)
+    hits = {k: [] for k in ks}
+    reciprocal_ranks = []
+    encode_ms, search_ms = [], []
+    build_sec = 0.0
+    memory = 0
+    per_corpus = {}
+
+    for corpus, items in gold.items():
+        index = build_corpus_index(model, load_corpus(corpus), chunker, similarity)
+        build_sec += index["build_sec"]
+        memory += index["memory_bytes"]
+        corpus_hits = []
+
+        for item in items:
+            expected = set(item["expected"])
+
+            start = time.perf_counter()
+            query_vector = model.encode(item["question"], show_progress_bar=False)
+            encode_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            if index["index"] is not None:
+                top, _ = index["index"].search_ids(_normalize(query_vector).reshape(-1), max_k)
+            else:
+                top = SIMILARITIES[similarity](query_vector, index["vectors"], index["normalized"], max_k)
+            search_ms.append((time.perf_counter() - start) * 1000)
+
+            retrieved = [index["paragraph_ids"][i] for i in top]
+            for k in ks:
+                found = set().union(*retrieved[:k]) if retrieved[:k] else set()
+                hits[k].append(len(found & expected) / len(expected))
+            rank = next((r for r, ids in enumerate(retrieved, 1) if ids & expected), None)
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+            corpus_hits.append(hits[max_k][-1])
+
+        per_corpus[corpus] = statistics.mean(corpus_hits) if corpus_hits else None
+
+    search_ms.sort()
+    return {
+        "recall": {k: statistics.mean(v) for k, v in hits.items()},
+        "mrr": statistics.mean(reciprocal_ranks),
+        "build_sec": build_sec,
+        "memory_mb": memory / 1024 / 1024,
+        "encode_ms_p50": statistics.median(encode_ms),
+        "search_ms_p50": statistics.median(search_ms),
+        "search_ms_p95": search_ms[int(0.95 * (len(search_ms) - 1))],
+        "per_corpus_recall": per_corpus,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAG検索の品質・速度評価")
+    parser.add_argument("--models", default=DEFAULT_MODEL, help="埋め込みモデル名（カンマ区切り）")
+    parser.add_argument("--chunkers", default="paragraph", help=f"チャンク分割（{', '.join(CHUNKERS)}）")
+    parser.add_argument("--similarity", default=",".join(INDEX_BACKENDS),
+                        help=f"検索方式（{', '.join(SEARCH_METHODS)}）")
+    parser.add_argument("--k", default="1,3,5", help="評価する k（カンマ区切り）")
+    parser.add_argument("--corpora", help="対象のコーパス名（カンマ区切り、省略時はすべて）")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--per-corpus", action="store_true", help="コーパスごとの recall も表示する")
+    args = parser.parse_args()
+
+    ks = [int(k) for k in args.k.split(",")]
+    gold = load_gold_sets(args.corpora.split(",") if args.corpora else None)
+    print(f"--- INFO: {len(gold)} コーパス / {sum(len(v) for v in gold.values())} 問で評価します ---")
+
+    results = []
+    for model_name in args.models.split(","):
+        model = SentenceTransformer(model_name)
+        for chunker in args.chunkers.split(","):
+            for similarity in args.similarity.split(","):
+                r = evaluate(model, gold, chunker, similarity, ks)
+                r.update({"model": model_name, "chunker": chunker, "similarity": similarity})
+                results.append(r)
+
+    header = f"{'model':<32}{'chunker':<11}{'sim':<12}" + "".join(f"{'R@' + str(k):>7}" for k in ks)
+    header += f"{'MRR':>7}{'build[s]':>10}{'mem[MB]':>9}{'enc[ms]':>9}{'srch p50':>10}{'srch p95':>10}"
+    print(header)
+    for r in results:
+        line = f"{r['model'][-31:]:<32}{r['chunker']:<11}{r['similarity']:<12}"
+        line += "".join(f"{r['recall'][k]:>7.3f}" for k in ks)
+        line += f"{r['mrr']:>7.3f}{r['build_sec']:>10.2f}{r['memory_mb']:>9.2f}{r['encode_ms_p50']:>9.1f}"
+        line += f"{r['search_ms_p50']:>10.3f}{r['search_ms_p95']:>10.3f}"
+        print(line)
+        if args.per_corpus:
+            for corpus, recall in r["per_corpus_recall"].items():
+                print(f"    {corpus:<12} R@{max(ks)}={recall:.3f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -1,14 +1,18 @@
-
+import os
 import streamlit as st
 import requests
 from bs4 import BeautifulSoup
 
 PASSWORD = st.secrets.get("CLASS_CHANGE_PASSWORD")
-TARGET_URL = "https://www.anan-nct.ac.jp/campuslife/update/"
-def fetch_class_changes(target_class=None):
+TARGET_URL = os.environ.get("ANAN_CLASS_CHANGE_URL", "https://www.anan-nct.ac.jp/campuslife/update/")
+LOGIN_URL = os.environ.get("ANAN_CLASS_CHANGE_LOGIN_URL", "https://www.anan-nct.ac.jp/wp-login.php?action=postpass")
+REQUEST_TIMEOUT = 15
+NOT_FOUND_MESSAGE = "授業変更データが取得できませんでした。（構造が変わった可能性）"
+
+def fetch_class_changes_text():
     """
-    授業変更ページから変更情報を取得する。
-    target_class に '1-2' '1-3' '2M' などが入れば、その行だけ抽出。
+    授業変更ページの本文テキストを取得する。
+    ページの構造が変わって本文が見つからない場合は None を返す。
     """
     session = requests.Session()
     session.headers.update({
@@ -17,17 +21,22 @@ def fetch_class_changes(target_class=None):
                       "Chrome/120.0.0.0 Safari/537.36"
     })
     # Step1: パスワードを送信してログイン
-    login_url = "https://www.anan-nct.ac.jp/wp-login.php?action=postpass"
     payload = {"post_password": PASSWORD}
-    session.post(login_url, data=payload)
+    session.post(LOGIN_URL, data=payload, timeout=REQUEST_TIMEOUT)
     # Step2: ログイン後のページを取得
-    response = session.get(TARGET_URL)
+    response = session.get(TARGET_URL, timeout=REQUEST_TIMEOUT)
     soup = BeautifulSoup(response.text, "html.parser")
     # 本文を抽出
     body = soup.find("div", class_="entry-body")
     if not body:
-        return "授業変更データが取得できませんでした。（構造が変わった可能性）"
-    text = body.get_text("\n", strip=True)
+        return None
+    return body.get_text("\n", strip=True)
+
+def filter_class_changes(text, target_class=None):
+    """
+    本文テキストからクラスに該当する行を抽出する。
+    target_class に '1-2' '1-3' '2M' などが入れば、その行だけ抽出。
+    """
     # クラス指定なし → 全部返す
     if not target_class:
         return text
@@ -38,4 +47,14 @@ def fetch_class_changes(target_class=None):
             results.append(line)
     if not results:
         return f"{target_class} の授業変更情報は見つかりませんでした。"
-    return "\n".join(results)
\ No newline at end of file
+    return "\n".join(results)
+
+def fetch_class_changes(target_class=None):
+    """
+    授業変更ページから変更情報を取得する。
+    target_class に '1-2' '1-3' '2M' などが入れば、その行だけ抽出。
+    """
+    text = fetch_class_changes_text()
+    if text is None:
+        return NOT_FOUND_MESSAGE
+    return filter_class_changes(text, target_class)
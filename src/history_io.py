@@ -0,0 +1,226 @@
+"""
+質問履歴のエクスポート / インポート。
+
+    # 2025年4月以降のチャット履歴を Parquet に書き出す
+    python history_io.py export --out history.parquet --start 2025-04-01 --page chat
+    # 別環境の履歴を取り込む（同じ日時・質問・回答の行はスキップ）
+    python history_io.py import --in other_history.csv
+"""
+import argparse
+import csv
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+HISTORY_DB = os.environ.get("ANAN_HISTORY_DB", "history.db")
+BATCH_SIZE = 1000
+COLUMNS = ["id", "question", "answer", "timestamp", "page"]
+
+
+# ================================
+# スキーマ
+# ================================
+def ensure_history_schema(conn):
+    """履歴テーブルを作成し、古いスキーマなら page 列と索引を追加する"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question TEXT,
+            answer TEXT,
+            timestamp TEXT,
+            page TEXT DEFAULT 'chat'
+        )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+    if "page" not in columns:
+        conn.execute("ALTER TABLE history ADD COLUMN page TEXT DEFAULT 'chat'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)")
+    conn.commit()
+
+
+# ================================
+# エクスポート
+# ================================
+def iter_history_batches(conn, start: date | None = None, end: date | None = None,
+                         page: str | None = None, batch_size: int = BATCH_SIZE):
+    """条件に合う履歴を batch_size 行ずつ返す（テーブル全体をメモリに載せない）"""
+    where, params = [], []
+    if start:
+        where.append("timestamp >= ?")
+        params.append(start.isoformat())
+    if end:
+        # end の日付を含める
+        where.append("timestamp < ?")
+        params.append((end + timedelta(days=1)).isoformat())
+    if page:
+        where.append("page = ?")
+        params.append(page)
+    sql = f"SELECT {', '.join(COLUMNS)} FROM history"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id"
+
+    cur = conn.execute(sql, params)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+
+
+def _write_csv(path, batches):
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for rows in batches:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+
+def _write_parquet(path, batches):
+    try:
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet 形式には pandas と pyarrow が必要です（pip install pyarrow）") from e
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("question", pa.string()),
+        ("answer", pa.string()),
+        ("timestamp", pa.string()),
+        ("page", pa.string()),
+    ])
+    count = 0
+    # バッチごとに行グループとして書き足していく
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in batches:
+            df = pd.DataFrame.from_records(rows, columns=COLUMNS)
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+            count += len(rows)
+    return count
+
+
+def export_history(path: str, fmt: str | None = None, start: date | None = None, end: date | None = None,
+                   page: str | None = None, batch_size: int = BATCH_SIZE, db_path: str = HISTORY_DB) -> int:
+    """履歴を CSV または Parquet に書き出し、書き出した行数を返す"""
+    fmt = fmt or ("parquet" if path.endswith(".parquet") else "csv")
+    conn = sqlite3.connect(db_path)
+    ensure_history_schema(conn)
+    try:
+        batches = iter_history_batches(conn, start, end, page, batch_size)
+        if fmt == "parquet":
+            return _write_parquet(path, batches)
+        if fmt == "csv":
+            return _write_csv(path, batches)
+        raise ValueError(f"未対応の形式です: {fmt}")
+    finally:
+        conn.close()
+
+
+# ================================
+# インポート
+# ================================
+def _read_csv(path, batch_size):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        batch = []
+        for row in csv.DictReader(f):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def _read_parquet(path, batch_size):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Parquet 形式には pyarrow が必要です（pip install pyarrow）") from e
+    for record_batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield record_batch.to_pylist()
+
+
+def _validate_row(row):
+    """
+    取り込む1行を検査し、(質問, 回答, 日時, ページ) を返す。
+    日時が ISO 形式で読めない行や、質問・回答が空の行は None（履歴の表示が壊れるため取り込まない）
+    """
+    question, answer, timestamp = row.get("question"), row.get("answer"), row.get("timestamp")
+    if not isinstance(question, str) or not question.strip():
+        return None
+    if not isinstance(answer, str) or not answer.strip():
+        return None
+    try:
+        timestamp = datetime.fromisoformat(str(timestamp)).isoformat()
+    except ValueError:
+        return None
+    return question, answer, timestamp, row.get("page") or "chat"
+
+
+def import_history(path: str, batch_size: int = BATCH_SIZE, db_path: str = HISTORY_DB):
+    """
+    CSV / Parquet の履歴を取り込み、(追加した行数, 不正でスキップした行数) を返す。
+    id は振り直し、日時・質問・回答が同じ行は既存とみなしてスキップする。
+    日時が読めない行や質問・回答が空の行は取り込まずに数える。
+    """
+    reader = _read_parquet if path.endswith(".parquet") else _read_csv
+    conn = sqlite3.connect(db_path)
+    ensure_history_schema(conn)
+    before = conn.total_changes
+    invalid = 0
+    try:
+        for batch in reader(path, batch_size):
+            rows = [_validate_row(r) for r in batch]
+            invalid += sum(1 for r in rows if r is None)
+            params = [
+                (question, answer, timestamp, page, timestamp, question, answer)
+                for question, answer, timestamp, page in (r for r in rows if r is not None)
+            ]
+            # バッチごとに1トランザクションでまとめて挿入する
+            with conn:
+                conn.executemany(
+                    """
+                    INSERT INTO history (question, answer, timestamp, page)
+                    SELECT ?, ?, ?, ?
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM history WHERE timestamp = ? AND question = ? AND answer = ?
+                    )
+                    """,
+                    params,
+                )
+        return conn.total_changes - before, invalid
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="質問履歴のエクスポート / インポート")
+    parser.add_argument("--db", default=HISTORY_DB, help="履歴DBのパス")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_export = sub.add_parser("export", help="履歴を書き出す")
+    p_export.add_argument("--out", required=True, help="出力先（.csv / .parquet）")
+    p_export.add_argument("--format", choices=["csv", "parquet"])
+    p_export.add_argument("--start", type=date.fromisoformat, help="開始日（YYYY-MM-DD）")
+    p_export.add_argument("--end", type=date.fromisoformat, help="終了日（YYYY-MM-DD、この日を含む）")
+    p_export.add_argument("--page", choices=["chat", "change"], help="ページで絞り込む")
+    p_export.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    p_import = sub.add_parser("import", help="履歴を取り込む")
+    p_import.add_argument("--in", dest="path", required=True, help="入力ファイル（.csv / .parquet）")
+    p_import.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        n = export_history(args.out, args.format, args.start, args.end, args.page, args.batch_size, args.db)
+        print(f"--- INFO: {n} 件を {args.out} に書き出しました ---")
+    else:
+        n, invalid = import_history(args.path, args.batch_size, args.db)
+        print(f"--- INFO: {n} 件を取り込みました ---")
+        if invalid:
+            print(f"警告: 日時が読めない、または質問・回答が空の {invalid} 件をスキップしました")
@@ -0,0 +1,406 @@
+import queue
+import threading
+import time
+import openai
+from openai import OpenAI
+
+# ================================
+# 設定
+# ================================
+HEALTH_CHECK_INTERVAL = 15.0   # 生存確認の間隔（秒）
+HEALTH_CHECK_TIMEOUT = 3.0     # 生存確認のタイムアウト（秒）
+EJECT_AFTER_FAILURES = 3       # 連続失敗がこの回数に達したら切り離す
+REQUEST_TIMEOUT = 60.0         # 1リクエストのタイムアウト（秒）
+
+
+class NoHealthyBackendError(Exception):
+    """利用可能なバックエンドが1つもない"""
+
+
+class CircuitOpenError(Exception):
+    """回路が開いているため呼び出しを行わなかった"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLMへの呼び出しを遮断中です（約{retry_after:.0f}秒後に再試行）")
+        self.retry_after = retry_after
+
+
+class _Cancelled(Exception):
+    """ヘッジで負けた側のリクエストを打ち切った"""
+
+
+# ================================
+# バックエンド1台分の状態
+# ================================
+class Backend:
+    def __init__(self, base_url: str, api_key: str, timeout: float):
+        self.base_url = base_url
+        self.client = OpenAI(base_url=base_url, api_key=api_key, timeout=timeout, max_retries=0)
+        self.outstanding = 0          # 処理中のリクエスト数
+        self.healthy = True
+        self.consecutive_failures = 0
+
+    def __repr__(self):
+        return f"Backend({self.base_url}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+
+def _is_backend_failure(error: Exception) -> bool:
+    """
+    バックエンド側の障害（接続エラー・タイムアウト・5xx・使えるバックエンドなし）なら True。
+    4xx はリクエスト自体の誤りでどのバックエンドでも同じ結果になるため、
+    切り離しや再試行、サーキットブレーカーの失敗数の対象にしない
+    """
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    # タイムアウト（APITimeoutError）やストリーミング中の切断も APIConnectionError になる
+    return isinstance(error, (openai.APIConnectionError, NoHealthyBackendError))
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+
+# ヘッジ時の1試行分の状態
+class _Attempt:
+    def __init__(self, backend: Backend):
+        self.backend = backend
+        self.first_token = threading.Event()
+        self.cancelled = threading.Event()
+        self.stream = None
+
+
+# ================================
+# OpenAI互換エンドポイントのプール
+# ================================
+class LLMPool:
+    """
+    複数のOpenAI互換エンドポイントに処理中リクエスト数が最小のものから振り分ける。
+    連続して失敗したバックエンドは切り離し、定期的な生存確認で復帰させる。
+    hedge_after を指定すると、その秒数以内に最初のトークンが返らない場合に
+    別のバックエンドへ同じリクエストを送り、先に応答した方を採用する。
+    """
+
+    def __init__(self, base_urls, api_key="EMPTY", hedge_after=None,
+                 timeout=REQUEST_TIMEOUT, eject_after=EJECT_AFTER_FAILURES):
+        if not base_urls:
+            raise ValueError("base_urls が空です")
+        self.backends = [Backend(u, api_key, timeout) for u in base_urls]
+        self.hedge_after = hedge_after
+        self.eject_after = eject_after
+        self._lock = threading.Lock()
+        self._health_thread = None
+        self._next = 0                # 処理中の数が同じバックエンドを順番に使うためのカウンタ
+
+    # ---- バックエンド選択 ----
+    def _pick(self, exclude=()):
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+            if not candidates:
+                raise NoHealthyBackendError("利用可能なLLMバックエンドがありません")
+            least = min(b.outstanding for b in candidates)
+            tied = [b for b in candidates if b.outstanding == least]
+            backend = tied[self._next % len(tied)]
+            self._next += 1
+            backend.outstanding += 1
+            return backend
+
+    def _done(self, backend: Backend, ok: bool | None):
+        # ok=None はバックエンドの障害ではない失敗（4xx など）で、連続失敗数は変えない
+        with self._lock:
+            backend.outstanding -= 1
+            if ok is None:
+                return
+            if ok:
+                backend.consecutive_failures = 0
+            else:
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.eject_after and backend.healthy:
+                    backend.healthy = False
+                    print(f"--- WARN: LLMバックエンド {backend.base_url} を切り離しました ---")
+
+    # ---- 生存確認 ----
+    def health_check_once(self):
+        for backend in self.backends:
+            try:
+                backend.client.with_options(timeout=HEALTH_CHECK_TIMEOUT).models.list()
+            except Exception:
+                with self._lock:
+                    backend.consecutive_failures += 1
+                    if backend.consecutive_failures >= self.eject_after and backend.healthy:
+                        backend.healthy = False
+                        print(f"--- WARN: LLMバックエンド {backend.base_url} を切り離しました ---")
+                continue
+            with self._lock:
+                if not backend.healthy:
+                    print(f"--- INFO: LLMバックエンド {backend.base_url} が復帰しました ---")
+                backend.healthy = True
+                backend.consecutive_failures = 0
+
+    def start_health_checks(self, interval: float = HEALTH_CHECK_INTERVAL):
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.health_check_once()
+
+        self._health_thread = threading.Thread(target=loop, name="llm-health-check", daemon=True)
+        self._health_thread.start()
+
+    def status(self):
+        with self._lock:
+            return [
+                {"base_url": b.base_url, "outstanding": b.outstanding,
+                 "healthy": b.healthy, "failures": b.consecutive_failures}
+                for b in self.backends
+            ]
+
+    # ---- 呼び出し ----
+    def chat(self, model, messages, max_tokens, temperature):
+        """
+        チャット補完を実行して (回答テキスト, 使用量) を返す。
+        使用量は {"prompt_tokens": .., "completion_tokens": ..}（サーバーが返さない場合は None）
+        """
+        kwargs = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        if not self.hedge_after or len(self.backends) < 2:
+            return self._call(kwargs)
+        return self._hedged_call(kwargs)
+
+    def _call(self, kwargs):
+        # 失敗したら未試行のバックエンドで再試行する
+        tried = []
+        while True:
+            try:
+                backend = self._pick(exclude=tried)
+            except NoHealthyBackendError:
+                if tried:
+                    raise last_error
+                raise
+            try:
+                resp = backend.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not _is_backend_failure(e):
+                    self._done(backend, ok=None)
+                    raise
+                self._done(backend, ok=False)
+                tried.append(backend)
+                last_error = e
+                continue
+            self._done(backend, ok=True)
+            return resp.choices[0].message.content, _usage_dict(resp.usage)
+
+    def _stream_attempt(self, att: _Attempt, kwargs, state, results):
+        backend = att.backend
+        parts = []
+        usage = None
+        try:
+            stream = backend.client.chat.completions.create(
+                stream=True, stream_options={"include_usage": True}, **kwargs
+            )
+            att.stream = stream
+            try:
+                # 応答ヘッダーを待つ間に負けていれば、ここで閉じる
+                if att.cancelled.is_set():
+                    raise _Cancelled()
+                for chunk in stream:
+                    if att.cancelled.is_set():
+                        raise _Cancelled()
+                    if chunk.usage:
+                        usage = _usage_dict(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    # 推論トークン（reasoning_content）も「応答が始まった」とみなす
+                    if not att.first_token.is_set() and (delta.content or getattr(delta, "reasoning_content", None)):
+                        self._claim(att, state)
+                    if delta.content:
+                        parts.append(delta.content)
+            finally:
+                stream.close()
+        except Exception as e:
+            # 勝者が決まって接続を閉じられた場合も、打ち切りとして扱う
+            if isinstance(e, _Cancelled) or att.cancelled.is_set():
+                self._done(backend, ok=True)
+                results.put((att, None, _Cancelled()))
+                return
+            self._done(backend, ok=False if _is_backend_failure(e) else None)
+            results.put((att, None, e))
+            return
+        self._done(backend, ok=True)
+        self._claim(att, state)
+        results.put((att, ("".join(parts), usage), None))
+
+    def _claim(self, att: _Attempt, state):
+        # 最初にトークンを返した試行を勝者とし、それ以外は打ち切る
+        att.first_token.set()
+        losers = []
+        with state["lock"]:
+            if state["winner"] is None:
+                state["winner"] = att
+                losers = [other for other in state["attempts"] if other is not att]
+                for other in losers:
+                    other.cancelled.set()
+            elif state["winner"] is not att:
+                att.cancelled.set()
+        # 次のチャンクを待たずに接続を閉じ、負けた側のバックエンドの枠をすぐ空ける
+        for other in losers:
+            if other.stream is not None:
+                try:
+                    other.stream.close()
+                except Exception:
+                    pass
+
+    def _hedged_call(self, kwargs):
+        results = queue.Queue()
+        state = {"lock": threading.Lock(), "winner": None, "attempts": []}
+
+        def launch(exclude=()):
+            att = _Attempt(self._pick(exclude))
+            with state["lock"]:
+                state["attempts"].append(att)
+            threading.Thread(
+                target=self._stream_attempt, args=(att, kwargs, state, results), daemon=True
+            ).start()
+            return att
+
+        primary = launch()
+        pending = 1
+        hedged = False
+        last_error = None
+        while pending:
+            try:
+                att, text, err = results.get(timeout=None if hedged else self.hedge_after)
+            except queue.Empty:
+                # 最初のトークンが遅い → 別のバックエンドにも投げる
+                hedged = True
+                if not primary.first_token.is_set():
+                    try:
+                        launch(exclude=[primary.backend])
+                        pending += 1
+                    except NoHealthyBackendError:
+                        pass
+                continue
+
+            pending -= 1
+            if err is None and state["winner"] is att:
+                return text
+            if err is not None and not isinstance(err, _Cancelled):
+                if not _is_backend_failure(err):
+                    # リクエスト自体の誤りは別のバックエンドでも同じなので、他の試行も打ち切って返す
+                    for other in state["attempts"]:
+                        other.cancelled.set()
+                    raise err
+                last_error = err
+                if not hedged:
+                    # 最初の試行がすぐに失敗した場合は別のバックエンドで再試行
+                    hedged = True
+                    try:
+                        launch(exclude=[att.backend])
+                        pending += 1
+                    except NoHealthyBackendError:
+                        pass
+        raise last_error or NoHealthyBackendError("すべてのLLMバックエンドで失敗しました")
+
+
+# ================================
+# サーキットブレーカー
+# ================================
+class CircuitBreaker:
+    """
+    連続 failure_threshold 回失敗（タイムアウト含む）したら回路を開き、
+    reset_timeout 秒間は呼び出さずに CircuitOpenError で即座に失敗させる。
+    その後は1件だけ試しに通し（半開）、成功すれば閉じ、失敗すればまた開く。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe = None            # 半開のときに通した試しの1件の目印
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def stats(self):
+        with self._lock:
+            return {"state": self._state, "failures": self._failures}
+
+    def _before_call(self):
+        """呼び出してよければ目印を返す（試しの1件なら専用の目印、閉じていれば None）"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return None
+            elapsed = time.monotonic() - self._opened_at
+            if self._state == self.OPEN and elapsed >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            # 半開のときは試しの1件だけ通す
+            if self._state == self.HALF_OPEN and self._probe is None:
+                self._probe = object()
+                return self._probe
+            raise CircuitOpenError(max(0.0, self.reset_timeout - elapsed))
+
+    def _after_call(self, ok: bool | None, token=None):
+        # ok=None はバックエンドの障害ではない失敗（4xx など）で、状態も失敗数も変えない
+        with self._lock:
+            if self._state != self.CLOSED:
+                # 回路が開く前から続いていた呼び出しの結果では状態を変えない
+                if token is None or token is not self._probe:
+                    return
+                self._probe = None
+                if ok is None:
+                    # 試しの枠だけ返し、次の呼び出しでもう一度試す
+                    return
+                if ok:
+                    print("--- INFO: LLMへの呼び出しを再開しました ---")
+                    self._state = self.CLOSED
+                    self._failures = 0
+                else:
+                    self._state = self.OPEN
+                    self._opened_at = time.monotonic()
+                return
+            if ok is None:
+                return
+            if ok:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                print(f"--- WARN: LLMへの呼び出しが{self._failures}回連続で失敗したため遮断します ---")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """
+        func を呼び出す。回路が開いていれば呼び出さずに CircuitOpenError。
+        4xx などバックエンドの障害でない例外はそのまま送出し、失敗として数えない
+        """
+        token = self._before_call()
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = True
+            return result
+        except Exception as e:
+            if not _is_backend_failure(e):
+                ok = None
+            raise
+        finally:
+            self._after_call(ok, token)
@@ -0,0 +1,295 @@
+"""
+複数の学生が同時にアプリを開いた状況を再現する負荷試験。
+
+Streamlit の AppTest でセッションを同時に N 個動かし、各ユーザーが
+ホーム → チャット（質問を送信） → 授業変更（取得） → 履歴 と操作する。
+LLM と学校サイトはローカルのスタブサーバーに置き換え、質問は履歴DBから再生する。
+
+本番サーバーと同じく、全セッションを1プロセスのスレッドで動かし、
+LLM の同時実行枠（admission.LLMGate）・サーキットブレーカー・cache_resource を共有する。
+- 1回目の操作（埋め込みモデルの読み込みなどの初期化を含む）は計測から外す
+- 各レベルは全セッションがそろってから一斉に開始し、LLM の順番待ちの最大数とブレーカーの状態も表示する
+
+    python load_test.py --levels 1,5,10,20 --history-db ../history.db
+"""
+import argparse
+import os
+import random
+import sqlite3
+import html
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from stub_llm_server import StubConfig, start_stub_server
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(BASE_DIR, "app.py")
+
+FALLBACK_QUESTIONS = [
+    "1年2組 火曜3限",
+    "1-3 月曜の時間割",
+    "髪型の校則は？",
+    "赤点の基準は？",
+    "寮の門限は何時？",
+    "交通機関が止まったら？",
+    "奨学金について教えて",
+    "部活の兼部はできますか？",
+]
+CHANGE_CLASSES = ["1-1", "1-2", "2M", "3I", "4E", ""]
+
+STUB_CHANGE_PAGE = """<html><body><div class="entry-body">
+<p>1-2 10/20(月) 3限 英語I → 数学I</p>
+<p>2M 10/20(月) 1限 休講</p>
+<p>3I 10/21(火) 2限 教室変更 → 情報演習室</p>
+<p>4E 10/22(水) 4限 補講</p>
+</div></body></html>"""
+
+
+# ==== スタブの学校サイト ====
+def start_stub_school_site(delay: float = 0.2):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, body: bytes):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._reply(b"ok")
+
+        def do_GET(self):
+            self._reply(STUB_CHANGE_PAGE.encode("utf-8"))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ==== 質問の読み込み ====
+def load_question_mix(history_db: str | None):
+    """履歴DBのチャット質問をそのまま（頻度の偏りも含めて）使う"""
+    if history_db and os.path.exists(history_db):
+        conn = sqlite3.connect(history_db)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(history)")}
+        sql = "SELECT question FROM history"
+        if "page" in columns:
+            sql += " WHERE page = 'chat'"
+        questions = [html.unescape(r[0]) for r in conn.execute(sql) if r[0]]
+        conn.close()
+        if questions:
+            return questions
+    return FALLBACK_QUESTIONS
+
+
+# ==== メモリ使用量 ====
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ==== 1ユーザー分の操作 ====
+def share_server_state():
+    """
+    AppTest を本番サーバーと同じくセッション間で状態を共有する形にする。
+    - Runtime: AppTest は実行のたびにグローバルな Runtime を差し替えて最後に None に戻すため、
+      同時に動かすと他のセッションの実行中に消える。消えている間は直前のものを返す
+    - ScriptCache: 実行ごとに app.py をコンパイルし直さず、サーバーと同様に1つを共有する
+      （Python 3.11 では同時の compile が SystemError になることがある）
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    last = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+            return cls._instance
+        if "runtime" not in last:
+            raise RuntimeError("Runtime hasn't been created!")
+        return last["runtime"]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or "runtime" in last)
+
+    script_cache = ScriptCache()
+    app_test.ScriptCache = lambda: script_cache
+    local_script_runner.ScriptCache = lambda: script_cache
+
+
+def write_secrets(workdir: str, secrets: dict):
+    # at.secrets はグローバルな st.secrets を実行ごとに差し替えるため、同時実行では使わない
+    os.makedirs(os.path.join(workdir, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workdir, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        for key, value in secrets.items():
+            f.write(f'{key} = "{value}"\n')
+
+
+def simulate_user(question: str, change_class: str, timeout: float):
+    from streamlit.testing.v1 import AppTest
+
+    timings = {}
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+
+    def step(name, action):
+        start = time.perf_counter()
+        action()
+        timings[name] = time.perf_counter() - start
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].value}")
+
+    def button(label):
+        return next(b for b in at.button if b.label == label)
+
+    step("home", at.run)
+    step("nav_chat", lambda: at.button(key="nav_chat").click().run())
+    at.text_input[0].input(question)
+    step("chat_submit", lambda: button("送信").click().run())
+    step("nav_change", lambda: at.button(key="nav_change").click().run())
+    at.text_input[0].input(change_class)
+    step("change_fetch", lambda: button("取得").click().run())
+    step("nav_history", lambda: at.button(key="nav_history").click().run())
+    return timings
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] if values else float("nan")
+
+
+def run_level(users: int, questions, timeout, seed):
+    from admission import llm_gate
+    from anan_ai import llm_breaker
+
+    rng = random.Random(seed)
+    plans = [(rng.choice(questions), rng.choice(CHANGE_CLASSES)) for _ in range(users)]
+    errors = []
+    results = []
+    # 全セッションと親がそろってから開始する。そろわないまま timeout を過ぎたら開始せずに打ち切る
+    barrier = threading.Barrier(users + 1)
+
+    def worker(plan):
+        try:
+            barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            errors.append("全セッションがそろわなかったため開始しませんでした")
+            return
+        start = time.perf_counter()
+        try:
+            timings = simulate_user(plan[0], plan[1], timeout)
+            timings["total"] = time.perf_counter() - start
+            results.append(timings)
+        except Exception as e:
+            errors.append(str(e))
+
+    # LLM の順番待ちが実際に起きているかを見るため、実行中の待ち人数の最大を記録する
+    peak = {"waiting": 0}
+    done = threading.Event()
+
+    def monitor():
+        while not done.wait(0.05):
+            peak["waiting"] = max(peak["waiting"], llm_gate.stats()["waiting"])
+
+    threads = [threading.Thread(target=worker, args=(plan,), daemon=True) for plan in plans]
+    for t in threads:
+        t.start()
+    threading.Thread(target=monitor, daemon=True).start()
+
+    try:
+        barrier.wait(timeout)
+    except threading.BrokenBarrierError:
+        pass
+    wall_start = time.perf_counter()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall_start
+    done.set()
+
+    return {
+        "users": users,
+        "ok": len(results),
+        "errors": errors,
+        "wall_sec": wall,
+        "throughput": len(results) / wall if wall else 0.0,
+        "steps": {
+            name: [r[name] for r in results]
+            for name in ["home", "nav_chat", "chat_submit", "nav_change", "change_fetch", "nav_history", "total"]
+        },
+        "llm_waiting_max": peak["waiting"],
+        "breaker": llm_breaker.state,
+        "rss_mb": current_rss_mb(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="同時セッション負荷試験")
+    parser.add_argument("--levels", default="1,5,10,20", help="同時ユーザー数（カンマ区切り）")
+    parser.add_argument("--history-db", default=os.environ.get("ANAN_HISTORY_DB", "history.db"),
+                        help="質問を再生する履歴DB")
+    parser.add_argument("--llm-ttft", type=float, default=0.5, help="スタブLLMの最初のトークンまでの時間（秒）")
+    parser.add_argument("--llm-token-delay", type=float, default=0.01, help="スタブLLMのトークン間隔（秒）")
+    parser.add_argument("--site-delay", type=float, default=0.2, help="スタブ学校サイトの応答時間（秒）")
+    parser.add_argument("--timeout", type=float, default=120, help="1操作あたりのタイムアウト（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    questions = load_question_mix(args.history_db)
+    llm_server, llm_url = start_stub_server(
+        config=StubConfig(ttft=args.llm_ttft, token_delay=args.llm_token_delay)
+    )
+    site_server, site_url = start_stub_school_site(args.site_delay)
+
+    # app.py を読み込む前にスタブへ向ける
+    os.environ["ANAN_LLM_BASE_URLS"] = llm_url
+    os.environ["ANAN_CLASS_CHANGE_URL"] = f"{site_url}/campuslife/update/"
+    os.environ["ANAN_CLASS_CHANGE_LOGIN_URL"] = f"{site_url}/wp-login.php?action=postpass"
+    # 全セッションが同じIP扱いになるため、IP単位の流量制御は実質無効にする
+    os.environ.setdefault("ANAN_RATE_LIMIT_BURST", "1000000")
+    os.environ.setdefault("ANAN_LLM_MAX_QUEUE", "1000")
+    # 履歴・キャッシュ・プロファイル等は一時ディレクトリに書く
+    workdir = tempfile.mkdtemp(prefix="anan-load-")
+    os.environ["ANAN_PROFILE_DIR"] = os.path.join(workdir, "profiles")
+    os.chdir(workdir)
+    write_secrets(workdir, {"ADMIN_PIN": "load-test", "CLASS_CHANGE_PASSWORD": "load-test"})
+    share_server_state()
+
+    print(f"--- INFO: 質問 {len(questions)} 件から再生 / 作業ディレクトリ {workdir} ---")
+    # 1回目は埋め込みモデルの読み込みなどの初期化を含むので計測から外す
+    simulate_user(questions[0], "", args.timeout)
+    print(f"--- INFO: 初期化完了 RSS {current_rss_mb():.0f} MB ---")
+
+    header = f"{'users':>6}{'ok':>5}{'err':>5}{'thru[u/s]':>11}"
+    for name in ["chat_submit", "change_fetch", "total"]:
+        header += f"{name + ' p50':>18}{'p95':>8}{'p99':>8}"
+    header += f"{'LLM待ち':>8}{'breaker':>11}{'RSS[MB]':>10}"
+    print(header)
+    for i, users in enumerate(int(n) for n in args.levels.split(",")):
+        r = run_level(users, questions, args.timeout, args.seed + i)
+        line = f"{r['users']:>6}{r['ok']:>5}{len(r['errors']):>5}{r['throughput']:>11.2f}"
+        for name in ["chat_submit", "change_fetch", "total"]:
+            values = r["steps"][name]
+            line += f"{percentile(values, 0.50):>18.2f}{percentile(values, 0.95):>8.2f}{percentile(values, 0.99):>8.2f}"
+        line += f"{r['llm_waiting_max']:>10}{r['breaker']:>11}{r['rss_mb']:>10.0f}"
+        print(line)
+        for e in r["errors"][:3]:
+            print(f"    エラー: {e}")
+
+    llm_server.shutdown()
+    site_server.shutdown()
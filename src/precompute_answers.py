@@ -0,0 +1,115 @@
+"""
+履歴からよく聞かれる質問を意図ごとに抽出し、回答を事前生成して answer_cache に保存する。
+アクセスの少ない時間帯に cron などで実行する想定。
+
+    # 毎日 3:00 に実行（1〜5時の間だけ動くようにする）
+    0 3 * * * cd /path/to/src && python precompute_answers.py --top 20 --window 1-5
+"""
+import argparse
+import html
+import os
+import sqlite3
+import sys
+from collections import Counter
+from datetime import datetime
+
+from answer_cache import (
+    INTENT_SOURCE_FILES,
+    normalize_question,
+    purge_stale_answers,
+    store_answer,
+)
+
+HISTORY_DB = os.environ.get("ANAN_HISTORY_DB", "history.db")
+
+
+# ==== 履歴から頻出質問を集計 ====
+def mine_frequent_questions(determine_intent, top: int, min_count: int):
+    """
+    意図ごとに頻出する質問を返す: {intent: [(代表の質問文, 件数), ...]}
+    表記ゆれは normalize_question でまとめ、最も多く使われた表記を代表にする
+    """
+    conn = sqlite3.connect(HISTORY_DB)
+    cur = conn.cursor()
+    cur.execute("SELECT question FROM history")
+    counts = Counter()
+    surfaces = {}
+    while True:
+        rows = cur.fetchmany(1000)
+        if not rows:
+            break
+        for (question,) in rows:
+            if not question:
+                continue
+            # 履歴にはエスケープ済みの文字列が入っている
+            question = html.unescape(question)
+            key = normalize_question(question)
+            counts[key] += 1
+            surfaces.setdefault(key, Counter())[question] += 1
+    conn.close()
+
+    by_intent = {}
+    for key, n in counts.most_common():
+        if n < min_count:
+            break
+        question = surfaces[key].most_common(1)[0][0]
+        intent = determine_intent(question)
+        if intent not in INTENT_SOURCE_FILES:
+            continue
+        bucket = by_intent.setdefault(intent, [])
+        if len(bucket) < top:
+            bucket.append((question, n))
+    return by_intent
+
+
+def in_window(window: str) -> bool:
+    start, end = (int(h) for h in window.split("-"))
+    hour = datetime.now().hour
+    return start <= hour < end if start <= end else (hour >= start or hour < end)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="頻出質問の回答を事前生成する")
+    parser.add_argument("--top", type=int, default=20, help="意図ごとに事前生成する質問数")
+    parser.add_argument("--min-count", type=int, default=2, help="この回数以上聞かれた質問だけ対象にする")
+    parser.add_argument("--window", help="実行を許可する時間帯（例: 1-5）。範囲外なら何もしない")
+    parser.add_argument("--dry-run", action="store_true", help="対象の質問を表示するだけで生成しない")
+    args = parser.parse_args()
+
+    if args.window and not in_window(args.window):
+        print(f"--- INFO: 実行時間帯 {args.window} 時の範囲外のため終了します ---")
+        sys.exit(0)
+
+    # 埋め込みモデルのロードに時間がかかるため、引数の確認後に読み込む
+    from anan_ai import (
+        answer_question,
+        determine_intent,
+        determine_intent_candidates,
+        load_rule_dbs,
+        timetable_data,
+    )
+    from corpora import CORPUS_REGISTRY
+
+    removed = purge_stale_answers()
+    print(f"--- INFO: 元データが更新された回答を {removed} 件削除しました ---")
+
+    targets = mine_frequent_questions(determine_intent, args.top, args.min_count)
+    for intent, questions in targets.items():
+        print(f"[{intent}] " + " / ".join(f"{q}({n})" for q, n in questions))
+    if args.dry_run:
+        sys.exit(0)
+
+    # 事前生成の対象の質問が当てはまるコーパスだけ取り込む
+    # （複数のコーパスに当てはまる質問は検索結果で意図が決まるため、候補すべてを取り込む）
+    names = {name for questions in targets.values() for question, _ in questions
+             for name in determine_intent_candidates(question) if name in CORPUS_REGISTRY}
+    dbs = load_rule_dbs(sorted(names))
+
+    stored = 0
+    for questions in targets.values():
+        for question, _ in questions:
+            # キャッシュの無効化は実際に回答に使った意図の元データで判定する
+            intent, answer = answer_question(question, timetable_data, dbs)
+            if store_answer(question, intent, answer):
+                stored += 1
+    print(f"--- INFO: {stored} 件の回答を事前生成しました ---")
@@ -0,0 +1,117 @@
+import cProfile
+import glob
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(__file__)
+PROFILE_DIR = os.environ.get("ANAN_PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+
+
+# ================================
+# リクエスト単位のプロファイラ
+# ================================
+class RequestProfiler:
+    """
+    管理者が arm(n) すると、次の n 件のリクエストを cProfile で計測して保存する。
+    無効時（残り0件）は整数の比較1回だけで素通りする。
+    ※ cProfile は呼び出したスレッドだけを計測する
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR):
+        self.directory = directory
+        self._remaining = 0
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        return self._remaining
+
+    def arm(self, n: int):
+        with self._lock:
+            self._remaining = max(0, int(n))
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+    def _give_back(self):
+        with self._lock:
+            self._remaining += 1
+
+    @contextmanager
+    def profile(self, label: str, **metadata):
+        if not self._remaining or not self._claim():
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 別のリクエストを計測中（同時に有効にできるのは1つだけの環境がある）
+            self._give_back()
+            yield
+            return
+
+        start = time.perf_counter()
+        started_at = datetime.now()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._save(profiler, label, metadata, time.perf_counter() - start, started_at)
+
+    def _save(self, profiler, label, metadata, elapsed, started_at):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{started_at.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        profiler.dump_stats(os.path.join(self.directory, f"{name}.prof"))
+        with open(os.path.join(self.directory, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "name": name,
+                "label": label,
+                "started_at": started_at.isoformat(timespec="seconds"),
+                "elapsed_sec": round(elapsed, 4),
+                **metadata,
+            }, f, ensure_ascii=False)
+
+    # ---- 保存済みプロファイルの参照 ----
+    def list_profiles(self, limit: int = 20):
+        """新しい順にメタデータのリストを返す"""
+        paths = sorted(glob.glob(os.path.join(self.directory, "*.json")), reverse=True)[:limit]
+        profiles = []
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                profiles.append(json.load(f))
+        return profiles
+
+    def profile_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.prof")
+
+    def top_functions(self, name: str, n: int = 20, sort: str = "cumulative"):
+        """累積時間の大きい関数の一覧を返す"""
+        stats = pstats.Stats(self.profile_path(name))
+        stats.sort_stats(sort)
+        rows = []
+        for func in stats.fcn_list[:n]:
+            cc, ncalls, tottime, cumtime, _ = stats.stats[func]
+            filename, line, funcname = func
+            rows.append({
+                "function": f"{funcname} ({os.path.basename(filename)}:{line})",
+                "ncalls": ncalls,
+                "tottime": round(tottime, 4),
+                "cumtime": round(cumtime, 4),
+            })
+        return rows
+
+
+# プロセス全体で共有するインスタンス
+request_profiler = RequestProfiler()
@@ -0,0 +1,176 @@
+import json
+import os
+import sqlite3
+import statistics
+from contextlib import closing
+from datetime import datetime
+
+# ================================
+# モデル設定
+# ================================
+LARGE_MODEL_NAME = os.environ.get("ANAN_LARGE_MODEL_NAME", "openai/gpt-oss-120b")
+# 小さいモデルは vLLM 側で配信しているときだけ ANAN_SMALL_MODEL_NAME で指定する（未指定なら大きい方を使う）
+SMALL_MODEL_NAME = os.environ.get("ANAN_SMALL_MODEL_NAME") or LARGE_MODEL_NAME
+
+# 利用実績の保存先（app.py の履歴DBと同じファイル）
+ROUTE_STATS_DB = os.environ.get("ANAN_ROUTE_STATS_DB", "history.db")
+
+# ================================
+# ルーティング表
+# ================================
+# ルート名 -> 呼び出しパラメータ
+# ※ gpt-oss は推論トークンも max_tokens に含まれるため、短答でも余裕を持たせる
+LARGE_MODEL_MAX_TOKENS = 1200
+
+
+def _small_budget(max_tokens: int) -> int:
+    """
+    短答ルートの出力上限。小さいモデルを別に指定したときだけ絞り、
+    大きいモデルで代用するときは推論で上限を使い切って回答が空にならないよう大きいモデルの上限にする
+    """
+    return max_tokens if SMALL_MODEL_NAME != LARGE_MODEL_NAME else LARGE_MODEL_MAX_TOKENS
+
+
+ROUTE_TABLE = {
+    # 1コマだけの時間割（例: 1年2組 火曜3限）
+    "timetable_period": {"model": SMALL_MODEL_NAME, "max_tokens": _small_budget(300), "temperature": 0.3},
+    # 1日分の時間割
+    "timetable_day": {"model": SMALL_MODEL_NAME, "max_tokens": _small_budget(500), "temperature": 0.3},
+    # 「何時まで」「いくら」など一言で答えられる規則の質問
+    "rules_short": {"model": SMALL_MODEL_NAME, "max_tokens": _small_budget(600), "temperature": 0.5},
+    # 手続きや理由の説明が必要な規則の質問
+    "rules_long": {"model": LARGE_MODEL_NAME, "max_tokens": LARGE_MODEL_MAX_TOKENS, "temperature": 0.7},
+}
+
+# JSONファイルでルーティング表を上書きできるようにする（計測結果からの調整用）
+_override_path = os.environ.get("ANAN_ROUTE_TABLE")
+if _override_path:
+    with open(_override_path, "r", encoding="utf-8") as f:
+        for _name, _params in json.load(f).items():
+            ROUTE_TABLE.setdefault(_name, {}).update(_params)
+
+# 規則が込み入っていて、短い質問でも説明が長くなりやすい意図
+LONG_ANSWER_INTENTS = {"grades", "abstract", "sinro", "money"}
+
+# 一言で答えられる質問の手がかり
+SHORT_ANSWER_KEYWORDS = ["何時", "いつ", "何円", "いくら", "何日", "何人", "何年", "できますか", "いいですか"]
+# 説明が必要な質問の手がかり
+LONG_ANSWER_KEYWORDS = ["なぜ", "理由", "詳しく", "方法", "手続き", "違い", "比較", "流れ", "条件", "どうすれば", "について"]
+
+SHORT_QUERY_MAX_LEN = 30
+
+
+# ================================
+# ルート選択
+# ================================
+def select_route(intent: str, query: str, period=None) -> str:
+    """意図と質問の複雑さからルート名を決める"""
+    if intent == "timetable":
+        return "timetable_period" if period else "timetable_day"
+
+    if any(k in query for k in LONG_ANSWER_KEYWORDS):
+        return "rules_long"
+    if intent in LONG_ANSWER_INTENTS:
+        return "rules_long"
+    if len(query) <= SHORT_QUERY_MAX_LEN and any(k in query for k in SHORT_ANSWER_KEYWORDS):
+        return "rules_short"
+    return "rules_long"
+
+
+# ================================
+# 利用実績の記録
+# ================================
+def _connect():
+    conn = sqlite3.connect(ROUTE_STATS_DB, timeout=5)
+    try:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS route_stats (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                route TEXT,
+                intent TEXT,
+                model TEXT,
+                latency REAL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                ok INTEGER
+            )
+        """)
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def record_route_usage(route, intent, model, latency, usage=None, ok=True):
+    usage = usage or {}
+    try:
+        with closing(_connect()) as conn:
+            conn.execute(
+                """
+                INSERT INTO route_stats
+                    (timestamp, route, intent, model, latency, prompt_tokens, completion_tokens, ok)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    datetime.now().isoformat(),
+                    route,
+                    intent,
+                    model,
+                    latency,
+                    usage.get("prompt_tokens"),
+                    usage.get("completion_tokens"),
+                    1 if ok else 0,
+                ),
+            )
+            conn.commit()
+    except sqlite3.Error as e:
+        # 計測の失敗で回答を止めない
+        print(f"警告: ルート実績の記録に失敗しました: {e}")
+
+
+def summarize_route_stats():
+    """ルートごとの件数・レイテンシ・トークン数の集計を返す"""
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            "SELECT route, model, latency, prompt_tokens, completion_tokens, ok FROM route_stats"
+        ).fetchall()
+
+    grouped = {}
+    for route, model, latency, p_tok, c_tok, ok in rows:
+        grouped.setdefault((route, model), []).append((latency, p_tok, c_tok, ok))
+
+    summary = []
+    for (route, model), items in sorted(grouped.items()):
+        latencies = sorted(i[0] for i in items if i[3])
+        completions = [i[2] for i in items if i[2] is not None]
+        prompts = [i[1] for i in items if i[1] is not None]
+        limit = ROUTE_TABLE.get(route, {}).get("max_tokens")
+        summary.append({
+            "route": route,
+            "model": model,
+            "count": len(items),
+            "errors": sum(1 for i in items if not i[3]),
+            "p50_latency": statistics.median(latencies) if latencies else None,
+            "p95_latency": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+            "avg_prompt_tokens": statistics.mean(prompts) if prompts else None,
+            "avg_completion_tokens": statistics.mean(completions) if completions else None,
+            "max_completion_tokens": max(completions) if completions else None,
+            # max_tokens に達した割合（高ければ上限が厳しすぎる）
+            "truncated_rate": (sum(1 for c in completions if limit and c >= limit) / len(completions))
+                              if completions else None,
+        })
+    return summary
+
+
+if __name__ == "__main__":
+    def fmt(v, spec):
+        return "-" if v is None else format(v, spec)
+
+    print(f"{'route':<18}{'model':<24}{'n':>6}{'err':>5}{'p50[s]':>8}{'p95[s]':>8}"
+          f"{'in_tok':>8}{'out_tok':>8}{'max_out':>8}{'trunc':>7}")
+    for s in summarize_route_stats():
+        print(f"{s['route']:<18}{s['model']:<24}{s['count']:>6}{s['errors']:>5}"
+              f"{fmt(s['p50_latency'], '.2f'):>8}{fmt(s['p95_latency'], '.2f'):>8}"
+              f"{fmt(s['avg_prompt_tokens'], '.0f'):>8}{fmt(s['avg_completion_tokens'], '.0f'):>8}"
+              f"{fmt(s['max_completion_tokens'], 'd'):>8}{fmt(s['truncated_rate'], '.0%'):>7}")
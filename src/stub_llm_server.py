@@ -0,0 +1,189 @@
+"""
+ローカル検証用のOpenAI互換スタブサーバー。
+
+使い方（3台起動してプールを試す例）:
+    python stub_llm_server.py --port 9001 &
+    python stub_llm_server.py --port 9002 --ttft 3.0 &
+    python stub_llm_server.py --port 9003 --fail-rate 1.0 &
+    ANAN_LLM_BASE_URLS=http://127.0.0.1:9001/v1,http://127.0.0.1:9002/v1,http://127.0.0.1:9003/v1 python anan_ai.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = "【回答】スタブサーバーからの回答です。時間割や校則の内容は実際のサーバーで確認してください。"
+
+
+class StubConfig:
+    def __init__(self, ttft=0.05, token_delay=0.01, fail_rate=0.0, answer=DEFAULT_ANSWER,
+                 prefill_per_char=0.0, prefix_cache=False, cache_block=16):
+        self.ttft = ttft                # 最初のトークンまでの遅延（秒）
+        self.token_delay = token_delay  # トークン間の遅延（秒）
+        self.fail_rate = fail_rate      # 500エラーを返す確率
+        self.answer = answer
+        # プロンプト1文字あたりのプレフィル時間（秒）。キャッシュ済みの部分はかからない
+        self.prefill_per_char = prefill_per_char
+        self.prefix_cache = prefix_cache
+        self.cache_block = cache_block  # キャッシュの単位（文字数）。vLLMのブロックに相当
+
+
+class _PrefixCache:
+    """vLLMの自動プレフィックスキャッシュを模した、先頭からのブロック一致キャッシュ"""
+
+    def __init__(self, block: int, max_blocks: int = 200000):
+        self.block = block
+        self.max_blocks = max_blocks
+        self._blocks = set()
+        self._lock = threading.Lock()
+
+    def lookup_and_insert(self, text: str) -> int:
+        """先頭から一致したキャッシュ済みの文字数を返し、今回のブロックを登録する"""
+        cached = 0
+        matching = True
+        digest = b""
+        with self._lock:
+            for start in range(0, len(text) - self.block + 1, self.block):
+                digest = hashlib.sha1(digest + text[start:start + self.block].encode("utf-8")).digest()
+                if matching and digest in self._blocks:
+                    cached += self.block
+                else:
+                    matching = False
+                    if len(self._blocks) < self.max_blocks:
+                        self._blocks.add(digest)
+        return cached
+
+
+def _serialize_messages(messages) -> str:
+    # チャットテンプレート適用後のトークン列の代わり
+    return "".join(f"<|{m.get('role')}|>{m.get('content') or ''}" for m in messages)
+
+
+def _make_handler(config: StubConfig):
+    cache = _PrefixCache(config.cache_block) if config.prefix_cache else None
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            req = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": "not found"})
+                return
+            if random.random() < config.fail_rate:
+                self._send_json(500, {"error": {"message": "stub failure"}})
+                return
+
+            tokens = list(config.answer)
+            prompt_tokens = sum(len(m.get("content") or "") for m in req.get("messages", []))
+            max_tokens = req.get("max_tokens") or len(tokens)
+            tokens = tokens[:max_tokens]
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            }
+            model = req.get("model", "stub")
+            resp_id = f"chatcmpl-{uuid.uuid4().hex}"
+            prompt_text = _serialize_messages(req.get("messages", []))
+            cached_chars = cache.lookup_and_insert(prompt_text) if cache else 0
+            time.sleep(config.ttft + (len(prompt_text) - cached_chars) * config.prefill_per_char)
+
+            if not req.get("stream"):
+                time.sleep(config.token_delay * len(tokens))
+                self._send_json(200, {
+                    "id": resp_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(tokens)}}],
+                    "usage": usage,
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                for i, tok in enumerate(tokens):
+                    if i:
+                        time.sleep(config.token_delay)
+                    self._send_event({
+                        "id": resp_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}],
+                    })
+                final = {
+                    "id": resp_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                }
+                if (req.get("stream_options") or {}).get("include_usage"):
+                    final["usage"] = usage
+                self._send_event(final)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # クライアント側で打ち切られた（ヘッジで負けた等）
+                pass
+            self.close_connection = True
+
+        def _send_event(self, body):
+            self.wfile.write(f"data: {json.dumps(body, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_stub_server(port=0, config: StubConfig | None = None):
+    """
+    スタブサーバーを別スレッドで起動し、(server, base_url) を返す。
+    停止するときは server.shutdown() を呼ぶ。
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(config or StubConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI互換スタブサーバー")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--ttft", type=float, default=0.05, help="最初のトークンまでの遅延（秒）")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="トークン間の遅延（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="500エラーを返す確率")
+    parser.add_argument("--prefill-per-char", type=float, default=0.0, help="プロンプト1文字あたりのプレフィル時間（秒）")
+    parser.add_argument("--prefix-cache", action="store_true", help="プレフィックスキャッシュを模擬する")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        ttft=args.ttft,
+        token_delay=args.token_delay,
+        fail_rate=args.fail_rate,
+        prefill_per_char=args.prefill_per_char,
+        prefix_cache=args.prefix_cache,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), _make_handler(config))
+    server.daemon_threads = True
+    print(f"--- INFO: スタブLLMサーバーを http://127.0.0.1:{args.port}/v1 で起動しました ---")
+    server.serve_forever()
@@ -0,0 +1,236 @@
+"""
+RAG用のベクトルインデックス。
+
+ANAN_VECTOR_INDEX で検索方式を切り替える（省略時は bruteforce）。
+- bruteforce: 全チャンクとの内積を計算する（厳密）
+- ivf: k-means でチャンクをクラスタに分け、質問に近いクラスタだけを調べる（近似）
+- graph: 近傍グラフを質問に近い方へたどって探す（近似）
+ANAN_VECTOR_INDEX_PARAMS に JSON でパラメータを渡せる（例: {"n_probe": 16}）。
+
+どの方式もコサイン類似度の高い順に [(チャンク本文, 類似度), ...] を返す。
+"""
+import heapq
+import json
+import os
+
+import numpy as np
+
+VECTOR_INDEX = os.environ.get("ANAN_VECTOR_INDEX", "bruteforce")
+VECTOR_INDEX_PARAMS = json.loads(os.environ.get("ANAN_VECTOR_INDEX_PARAMS", "{}"))
+# k-means や類似度行列をこの行数ずつ計算してメモリ使用量を抑える
+BATCH_ROWS = 65536
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores, k):
+    """scores の大きい順に上位 k 件の位置を返す"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _assign(vectors, centroids):
+    """各ベクトルを最も近いセントロイドに割り当てる"""
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), BATCH_ROWS):
+        assign[start:start + BATCH_ROWS] = np.argmax(vectors[start:start + BATCH_ROWS] @ centroids.T, axis=1)
+    return assign
+
+
+def _group(assign, n_clusters):
+    """クラスタ番号順に並べた位置と、各クラスタの開始位置を返す"""
+    order = np.argsort(assign, kind="stable")
+    offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=n_clusters))
+    return order, offsets
+
+
+def kmeans(vectors, n_clusters: int, iterations: int = 10, sample_size: int = 100_000, seed: int = 0):
+    """
+    正規化済みベクトルの球面 k-means（NumPy のみ）。
+    件数が多いときは sample_size 件の標本で学習する。
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        order, offsets = _group(_assign(vectors, centroids), n_clusters)
+        counts = np.diff(offsets)
+        nonempty = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[order], offsets[nonempty], axis=0)
+        # 空になったクラスタはランダムな点で置き直す
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+# ================================
+# インデックス
+# ================================
+class VectorIndex:
+    name = ""
+
+    def __init__(self, chunks, vectors):
+        self.chunks = list(chunks)
+        self.vectors = _normalize(vectors)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def search_ids(self, query_vector, k: int):
+        """(チャンク番号の配列, 類似度の配列) を類似度の高い順に返す"""
+        raise NotImplementedError
+
+    def search(self, query_vector, k: int = 5):
+        ids, scores = self.search_ids(_normalize(query_vector).reshape(-1), k)
+        return [(self.chunks[i], float(s)) for i, s in zip(ids, scores)]
+
+    def memory_bytes(self) -> int:
+        """ベクトルと検索用の構造が使うバイト数（チャンク本文は含まない）"""
+        return self.vectors.nbytes
+
+
+class BruteForceIndex(VectorIndex):
+    name = "bruteforce"
+
+    def search_ids(self, query_vector, k):
+        scores = self.vectors @ query_vector
+        top = _top_k(scores, k)
+        return top, scores[top]
+
+
+class IVFIndex(VectorIndex):
+    """
+    転置ファイル（IVF）方式。n_lists 個のクラスタのうち、質問に近い n_probe 個だけを調べる。
+    n_lists 省略時は √件数。
+    """
+    name = "ivf"
+
+    def __init__(self, chunks, vectors, n_lists: int | None = None, n_probe: int = 8,
+                 iterations: int = 10, seed: int = 0):
+        super().__init__(chunks, vectors)
+        n_lists = n_lists or max(1, int(np.sqrt(len(self.vectors))))
+        self.centroids = kmeans(self.vectors, n_lists, iterations, seed=seed)
+        self.n_probe = n_probe
+        # 同じクラスタのベクトルが連続するように並べ替えて持つ
+        self.order, self.offsets = _group(_assign(self.vectors, self.centroids), len(self.centroids))
+        self.vectors = self.vectors[self.order]
+
+    def search_ids(self, query_vector, k):
+        probe = _top_k(self.centroids @ query_vector, self.n_probe)
+        positions = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in probe])
+        scores = self.vectors[positions] @ query_vector
+        top = _top_k(scores, k)
+        return self.order[positions[top]], scores[top]
+
+    def memory_bytes(self):
+        return self.vectors.nbytes + self.centroids.nbytes + self.order.nbytes + self.offsets.nbytes
+
+
+class GraphIndex(VectorIndex):
+    """
+    近傍グラフ方式。各チャンクから類似度の高い degree 個のチャンクへ辺を張り、
+    検索時は質問に近い n_entry 個のクラスタの代表点（各 entries_per_cluster 個）から、
+    より近いチャンクへ貪欲にたどる（幅 ef のビーム探索）。
+    グラフはクラスタ単位で、自分と近くの build_probe 個のクラスタ内の点から近傍を選んで作る。
+    辺の random_ratio の割合は、同じ範囲からランダムに選んだ点への辺にする。
+    """
+    name = "graph"
+
+    def __init__(self, chunks, vectors, degree: int = 16, ef: int = 64, n_entry: int = 4,
+                 entries_per_cluster: int = 32, build_probe: int = 3, random_ratio: float = 0.25,
+                 iterations: int = 10, seed: int = 0):
+        super().__init__(chunks, vectors)
+        self.ef = ef
+        self.n_entry = n_entry
+
+        n = len(self.vectors)
+        self.centroids = kmeans(self.vectors, max(1, int(np.sqrt(n))), iterations, seed=seed)
+        n_clusters = len(self.centroids)
+        order, offsets = _group(_assign(self.vectors, self.centroids), n_clusters)
+        members = [order[offsets[c]:offsets[c + 1]] for c in range(n_clusters)]
+        nearby = [_top_k(self.centroids @ centroid, build_probe) for centroid in self.centroids]
+
+        self.graph = np.full((n, min(degree, max(1, n - 1))), -1, dtype=np.int32)
+        n_random = int(self.graph.shape[1] * random_ratio) if n > 2 else 0
+        rng = np.random.default_rng(seed)
+        self.entries = np.full((n_clusters, entries_per_cluster), -1, dtype=np.int64)
+        for c, points in enumerate(members):
+            if not len(points):
+                continue
+            # 自クラスタの点を先頭に置き、対角（自分自身）を除外する
+            candidates = np.concatenate([points] + [members[o] for o in nearby[c] if o != c])
+            sims = self.vectors[points] @ self.vectors[candidates].T
+            sims[np.arange(len(points)), np.arange(len(points))] = -np.inf
+            d = min(self.graph.shape[1] - n_random, len(candidates) - 1)
+            if d > 0:
+                self.graph[points, :d] = candidates[np.argpartition(-sims, d - 1, axis=1)[:, :d]]
+            # 近傍だけだとトピックごとに島に分かれてたどり着けないので、近くのクラスタへの辺も混ぜる
+            if n_random and len(candidates) > 1:
+                self.graph[points, -n_random:] = candidates[rng.integers(0, len(candidates), (len(points), n_random))]
+            picks = rng.choice(points, min(entries_per_cluster, len(points)), replace=False)
+            self.entries[c, :len(picks)] = picks
+
+    def search_ids(self, query_vector, k):
+        entries = self.entries[_top_k(self.centroids @ query_vector, self.n_entry)].reshape(-1)
+        entries = entries[entries >= 0]
+        ef = max(self.ef, k)
+
+        visited = set(entries.tolist())
+        scores = self.vectors[entries] @ query_vector
+        candidates = [(-s, i) for i, s in zip(entries.tolist(), scores.tolist())]
+        heapq.heapify(candidates)
+        results = [(s, i) for i, s in zip(entries.tolist(), scores.tolist())]
+        heapq.heapify(results)
+
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_score < results[0][0]:
+                break
+            neighbors = [j for j in self.graph[node].tolist() if j >= 0 and j not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for j, s in zip(neighbors, (self.vectors[neighbors] @ query_vector).tolist()):
+                if len(results) < ef or s > results[0][0]:
+                    heapq.heappush(candidates, (-s, j))
+                    heapq.heappush(results, (s, j))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        top = heapq.nlargest(k, results)
+        return np.array([i for _, i in top], dtype=np.int64), np.array([s for s, _ in top], dtype=np.float32)
+
+    def memory_bytes(self):
+        return self.vectors.nbytes + self.centroids.nbytes + self.graph.nbytes + self.entries.nbytes
+
+
+INDEX_BACKENDS = {
+    "bruteforce": BruteForceIndex,
+    "ivf": IVFIndex,
+    "graph": GraphIndex,
+}
+
+
+def build_index(chunks, vectors, backend: str | None = None, **params):
+    """設定（ANAN_VECTOR_INDEX / ANAN_VECTOR_INDEX_PARAMS）に従ってインデックスを作る"""
+    backend = backend or VECTOR_INDEX
+    if backend not in INDEX_BACKENDS:
+        raise ValueError(f"未対応のインデックス方式です: {backend}（{', '.join(INDEX_BACKENDS)}）")
+    if backend == VECTOR_INDEX:
+        params = {**VECTOR_INDEX_PARAMS, **params}
+    return INDEX_BACKENDS[backend](chunks, vectors, **params)
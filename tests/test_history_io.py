@@ -0,0 +1,30 @@
+import csv
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from history_io import import_history  # noqa: E402
+
+
+def test_import_history_skips_malformed_rows(tmp_path):
+    src = tmp_path / "history.csv"
+    with open(src, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "question", "answer", "timestamp", "page"])
+        writer.writerow([1, "寮の門限は？", "22時です", "2025-04-01T10:00:00", "chat"])
+        writer.writerow([2, "髪の校則は？", "自由です", "昨日", "chat"])          # 日時が ISO 形式でない
+        writer.writerow([3, "", "空の質問", "2025-04-01T11:00:00", "chat"])      # 質問が空
+        writer.writerow([4, "赤点は？", "", "2025-04-01T12:00:00", "chat"])      # 回答が空
+        writer.writerow([5, "奨学金は？", "あります", "", "chat"])                # 日時なし
+    db = tmp_path / "history.db"
+
+    assert import_history(str(src), db_path=str(db)) == (1, 4)
+    # 同じファイルをもう一度取り込んでも重複しない
+    assert import_history(str(src), db_path=str(db)) == (0, 4)
+
+    conn = sqlite3.connect(db)
+    rows = conn.execute("SELECT question, answer, timestamp, page FROM history").fetchall()
+    conn.close()
+    assert rows == [("寮の門限は？", "22時です", "2025-04-01T10:00:00", "chat")]